@@ -1,79 +1,122 @@
-import networkx as nx
 import numpy as np
 
 import xml.etree.ElementTree as ET
+import os
 import re
 
+GRAPHML_NS = '{http://graphml.graphdrawing.org/xmlns}'
+TOOLTIP_RE = re.compile(r'([A-Z]+)\(lngx=([-+]?\d*\.\d+|\d+),laty=([-+]?\d*\.\d+|\d+)')
+ARRAY_FIELDS = ('node_ids', 'names', 'longitude', 'latitude', 'x', 'y', 'edge_array')
+
 
 class AirlineDataset:
-    def __init__(self, path):
+    def __init__(self, path, sidecar=False):
         self.dataset_path = path
-        self.edges = self._get_edges()
-        self.n_edges = len(self.edges)
-        self.nodes = self._get_nodes()
-        self.n_nodes = len(self.nodes)
-
-    def _get_nodes(self) -> list:
-        def convert_format(index, node_data):
-            tooltip = node_data['tooltip']
-
-            # Extracting the name, longitude, and latitude using regex
-            name_match = re.search(r'([A-Z]+)\(lngx', tooltip)
-            coord_match = re.search(r'lngx=([-+]?\d*\.\d+|\d+),laty=([-+]?\d*\.\d+|\d+)', tooltip)
-
-            if name_match and coord_match:
-                name = name_match.group(1)
-                longitude = float(coord_match.group(1))
-                latitude = float(coord_match.group(2))
-            else:
-                raise ValueError("Invalid format for tooltip")
-
-            return {
-                'edges' : [],
-                'index' : index,
-                'name': name,
-                'latitude': latitude,
-                'longitude': longitude
-            }
-
-        graph = nx.read_graphml(self.dataset_path)
-        nodes = []
-
-        for node, data in graph.nodes(data=True):
-            if 'tooltip' in data:
-                formatted_node = convert_format(int(node), data)
-                nodes.append(formatted_node)
-            else:
-                raise ValueError(f"Node {node} does not contain 'tooltip' attribute")
-
-        return nodes
-
-    def _get_edges(self) -> list:
-        with open(self.dataset_path, 'r') as file:
-            graphml_data = file.read()
-
-        root = ET.fromstring(graphml_data)
-        namespace = {'graphml': 'http://graphml.graphdrawing.org/xmlns'}
-        edges = []
-
-        for edge in root.findall('.//graphml:edge', namespace):
-            source = int(edge.attrib['source'])
-            target = int(edge.attrib['target'])
-            edges.append((source, target))
-
-        return edges
+        self.sidecar_path = path + '.arrays'
+
+        if not (sidecar and self._load_sidecar()):
+            self._parse()
+            if sidecar:
+                self._write_sidecar()
+
+        self.n_edges = len(self.edge_array)
+        self.n_nodes = len(self.node_ids)
+        self._nodes = None
+        self._edges = None
+
+    # Streams the GraphML file once, keeping only the per-node and per-edge values in flat arrays
+    def _parse(self):
+        key_names = {}
+        node_ids, names, longitude, latitude, xs, ys = [], [], [], [], [], []
+        sources, targets = [], []
+        data = {}
+
+        for event, elem in ET.iterparse(self.dataset_path, events=('end',)):
+            tag = elem.tag[len(GRAPHML_NS):] if elem.tag.startswith(GRAPHML_NS) else elem.tag
+
+            if tag == 'key':
+                key_names[elem.attrib['id']] = elem.attrib.get('attr.name', elem.attrib['id'])
+            elif tag == 'data':
+                data[key_names.get(elem.attrib['key'], elem.attrib['key'])] = elem.text
+            elif tag == 'node':
+                if 'tooltip' not in data:
+                    raise ValueError(f"Node {elem.attrib['id']} does not contain 'tooltip' attribute")
+
+                # Extracting the name, longitude, and latitude using regex
+                tooltip_match = TOOLTIP_RE.search(data['tooltip'])
+                if not tooltip_match:
+                    raise ValueError("Invalid format for tooltip")
+
+                node_ids.append(elem.attrib['id'])
+                names.append(tooltip_match.group(1))
+                longitude.append(float(tooltip_match.group(2)))
+                latitude.append(float(tooltip_match.group(3)))
+                xs.append(float(data.get('x', 'nan')))
+                ys.append(float(data.get('y', 'nan')))
+                data = {}
+                elem.clear()
+            elif tag == 'edge':
+                sources.append(elem.attrib['source'])
+                targets.append(elem.attrib['target'])
+                data = {}
+                elem.clear()
+
+        # Edges refer to nodes by their position in the node arrays
+        positions = {node_id: i for i, node_id in enumerate(node_ids)}
+        self.node_ids = np.array([int(node_id) for node_id in node_ids], dtype=np.int64)
+        self.names = np.array(names, dtype=str)
+        self.longitude = np.array(longitude, dtype=np.float64)
+        self.latitude = np.array(latitude, dtype=np.float64)
+        self.x = np.array(xs, dtype=np.float64)
+        self.y = np.array(ys, dtype=np.float64)
+        self.edge_array = np.array([(positions[s], positions[t]) for s, t in zip(sources, targets)],
+                                   dtype=np.int32).reshape(-1, 2)
+
+    def _source_stamp(self) -> np.ndarray:
+        stat = os.stat(self.dataset_path)
+        return np.array([stat.st_size, stat.st_mtime_ns], dtype=np.int64)
+
+    def _load_sidecar(self) -> bool:
+        try:
+            stamp = np.load(os.path.join(self.sidecar_path, 'stamp.npy'))
+            if not np.array_equal(stamp, self._source_stamp()):
+                return False
+            for field in ARRAY_FIELDS:
+                setattr(self, field, np.load(os.path.join(self.sidecar_path, field + '.npy'), mmap_mode='r'))
+        except (FileNotFoundError, ValueError):
+            return False
+
+        return True
+
+    def _write_sidecar(self):
+        os.makedirs(self.sidecar_path, exist_ok=True)
+        for field in ARRAY_FIELDS:
+            np.save(os.path.join(self.sidecar_path, field + '.npy'), getattr(self, field))
+        # The stamp goes last so that an interrupted write is never taken for a valid sidecar
+        np.save(os.path.join(self.sidecar_path, 'stamp.npy'), self._source_stamp())
+
+    # Per-node dicts, built on first access for code that works with individual airports
+    @property
+    def nodes(self) -> list:
+        if self._nodes is None:
+            self._nodes = [{
+                'edges': [],
+                'index': i,
+                'name': str(self.names[i]),
+                'latitude': float(self.latitude[i]),
+                'longitude': float(self.longitude[i])
+            } for i in range(self.n_nodes)]
+        return self._nodes
+
+    @property
+    def edges(self) -> list:
+        if self._edges is None:
+            self._edges = [(int(source), int(target)) for source, target in self.edge_array]
+        return self._edges
 
     def transform_edges(self) -> np.ndarray:
-        tmp_nodes = [node for node in nx.read_graphml(self.dataset_path).nodes(data=True)]
-        transformed_edges = np.zeros((self.n_edges, 2, 2))
-
-        for idx, (from_edge, to_edge) in enumerate(self.edges):
-            from_coords = np.array([tmp_nodes[from_edge][1]["x"], tmp_nodes[from_edge][1]["y"]])
-            to_coords = np.array([tmp_nodes[to_edge][1]["x"], tmp_nodes[to_edge][1]["y"]])
-            transformed_edges[idx, 0, :] = from_coords
-            transformed_edges[idx, 1, :] = to_coords
-
-        return transformed_edges
+        coords = np.stack([self.x, self.y], axis=-1)
+        return coords[self.edge_array]
 
 
 if __name__ == '__main__':
@@ -0,0 +1,289 @@
+import argparse
+import json
+import multiprocessing as mp
+import os
+import platform
+import sys
+import time
+import tracemalloc
+
+import numpy as np
+
+from airline_dataset import AirlineDataset
+from bundle import StageTimer, add_fdeb_arguments, check_fdeb_arguments, make_fdeb
+from layout import GraphLayout
+
+# Continental USA, the area the airline dataset covers
+LONGITUDE_RANGE = (-124.0, -67.0)
+LATITUDE_RANGE = (25.0, 49.0)
+
+# Settings of main.py, data/edges_fdeb_best.npy holds its scene coordinates divided by REFERENCE_SCALE
+REFERENCE_SETTINGS = {'engine': 'fdeb', 'n_levels': 0, 'n_cycles': 6, 'n_iter': 60, 'coord_scale': 100.0}
+REFERENCE_SCALE = 100
+
+
+# Airline-like route network with the same attributes as AirlineDataset, so GraphLayout and the bundler take it
+# as is. Airports are scattered around a few metropolitan clusters, cluster and airport popularity both follow
+# a power law. Every route connects an airport drawn by popularity with one drawn mostly uniformly, which gives
+# the hub-and-spoke degree distribution of the real data, and with probability locality the second airport is
+# taken from the cluster of the first, which keeps most routes regional. Routes are unique, undirected and
+# without self-loops.
+class SyntheticRoutes:
+    def __init__(self, n_edges: int, n_nodes: int = None, n_clusters: int = 12, hub_exponent: float = 1.2,
+                 spread: float = 1.5, locality: float = 0.6, seed: int = 0):
+        rng = np.random.default_rng(seed)
+        self.n_nodes = n_nodes or max(50, int(n_edges ** 0.75))
+        if n_edges > self.n_nodes * (self.n_nodes - 1) // 2:
+            raise ValueError(f'{self.n_nodes} airports cannot have {n_edges} distinct routes')
+
+        # Airports around cluster centres, popular clusters get more airports
+        centers = np.stack([rng.uniform(*LONGITUDE_RANGE, n_clusters), rng.uniform(*LATITUDE_RANGE, n_clusters)], -1)
+        cluster_weights = 1 / np.arange(1, n_clusters + 1)
+        clusters = rng.choice(n_clusters, self.n_nodes, p=cluster_weights / cluster_weights.sum())
+        positions = centers[clusters] + rng.normal(0, spread, (self.n_nodes, 2))
+        self.longitude = np.clip(positions[:, 0], *LONGITUDE_RANGE)
+        self.latitude = np.clip(positions[:, 1], *LATITUDE_RANGE)
+
+        hub_weights = 1 / rng.permutation(np.arange(1, self.n_nodes + 1)) ** hub_exponent
+        hub_weights /= hub_weights.sum()
+        spoke_weights = 0.3 * hub_weights + 0.7 / self.n_nodes
+        members = np.argsort(clusters, kind='stable')
+        cluster_sizes = np.bincount(clusters, minlength=n_clusters)
+        cluster_starts = np.cumsum(cluster_sizes) - cluster_sizes
+
+        # Draw routes in batches until there are enough distinct ones
+        keys = np.zeros(0, dtype=np.int64)
+        while len(keys) < n_edges:
+            batch = 2 * (n_edges - len(keys)) + 64
+            a = rng.choice(self.n_nodes, batch, p=hub_weights)
+            b = rng.choice(self.n_nodes, batch, p=spoke_weights)
+            local = rng.random(batch) < locality
+            offsets = (rng.random(batch) * cluster_sizes[clusters[a]]).astype(np.int64)
+            b[local] = members[cluster_starts[clusters[a]] + offsets][local]
+            a, b = np.minimum(a, b)[a != b], np.maximum(a, b)[a != b]
+            candidates = np.concatenate([keys, a.astype(np.int64) * self.n_nodes + b])
+            _, first = np.unique(candidates, return_index=True)
+            keys = candidates[np.sort(first)]
+        keys = keys[:n_edges]
+
+        self.n_edges = n_edges
+        self.edge_array = np.stack([keys // self.n_nodes, keys % self.n_nodes], axis=-1).astype(np.int32)
+        self.node_ids = [f'n{i}' for i in range(self.n_nodes)]
+        self.names = [f'S{i:04d}' for i in range(self.n_nodes)]
+
+
+def parse_args(argv=None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description='Benchmark the edge bundler on synthetic route networks.')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[500, 2000, 10000], help='edge counts to run')
+    parser.add_argument('--seed', type=int, default=0, help='seed of the synthetic networks')
+    parser.add_argument('--force-iterations', type=int, default=5, help='iterations of the forces stage')
+    parser.add_argument('--dense-limit', type=int, default=5000,
+                        help='largest edge count for which the dense compatibility matrix is also timed')
+    parser.add_argument('--output', default='output/benchmark.json', help='machine readable results')
+    parser.add_argument('--baseline', default=None, help='results of an earlier run to compare against')
+    parser.add_argument('--threshold', type=float, default=1.25, help='slowdown factor reported as a regression')
+    parser.add_argument('--min-seconds', type=float, default=0.05,
+                        help='stages faster than this in the baseline are too noisy to compare')
+    parser.add_argument('--reference', default=None, help='edges_fdeb_best.npy to check the bundling against')
+    parser.add_argument('--graph', default='data/airlines.graphml', help='graph the reference was bundled from')
+    parser.add_argument('--reference-tolerance', type=float, default=0.5,
+                        help='allowed change of the reference deviation against the baseline, in scene units')
+    add_fdeb_arguments(parser)
+    return check_fdeb_arguments(parser, parser.parse_args(argv))
+
+
+# Times the compatibility, subdivision and force kernels on their own. They use the serial kernels on coordinates
+# prepared the way my_fdeb prepares them. Returns the number of compatible pairs.
+def time_kernels(timer: StageTimer, coords: np.ndarray, args: argparse.Namespace) -> int:
+    fdeb = make_fdeb(argparse.Namespace(**{**vars(args), 'workers': 1}))
+    center, scale = fdeb.frame(coords)
+    edges = ((coords - center) / scale).astype(fdeb.dtype)
+
+    if fdeb.sparse_compat:
+        compat = timer.run('compatibility', fdeb.get_sparse_edge_compatibility, edges)
+        n_pairs = len(compat)
+        if len(coords) <= args.dense_limit:
+            timer.run('compatibility_dense', fdeb.get_edge_compatibility, edges)
+    else:
+        compat = timer.run('compatibility', fdeb.get_edge_compatibility, edges)
+        n_pairs = int((compat.sum() - np.trace(compat)) // 2)
+
+    # Last cycle of the schedule: subdivide the previous cycle's polylines and relax them
+    schedule = fdeb.schedule()
+    num_points, segments, _, lr_val = schedule[-1]
+    previous = fdeb.subdivide_edges(edges, schedule[-2][0]) if len(schedule) > 1 else edges
+    subdivided = timer.run('subdivide', fdeb.subdivide_edges, previous, num_points).astype(fdeb.dtype, copy=False)
+    lengths = np.linalg.norm(edges[:, 0] - edges[:, -1], axis=-1, keepdims=True)
+    kp_values = (fdeb.K / (lengths * segments + 1e-8))[..., None].astype(fdeb.dtype)
+    timer.run('forces', fdeb.relax, subdivided, compat, kp_values, args.force_iterations, lr_val)
+    fdeb.workspace = None
+    return n_pairs
+
+
+# Times every stage of the bundler on one synthetic network. Runs in its own process, so the peak RSS is the
+# one of this case alone.
+def run_case(n_edges: int, args: argparse.Namespace) -> dict:
+    tracemalloc.start()
+    timer = StageTimer()
+    start = time.perf_counter()
+
+    dataset = timer.run('generate', SyntheticRoutes, n_edges, seed=args.seed)
+    layout = timer.run('project', GraphLayout, dataset, 1000, 1000, 20)
+
+    # The flat kernels are only timed for flat FDEB, the multilevel and KDE engines never run them on all edges
+    n_pairs = time_kernels(timer, layout.edge_coords, args) if args.n_levels == 0 and args.engine == 'fdeb' else None
+    coords = layout.edge_coords
+
+    bundled = timer.run('bundle', make_fdeb(args).my_fdeb, coords.copy())
+
+    stages = timer.stages
+    if 'forces' in stages:
+        stages['forces']['seconds_per_iteration'] = stages['forces']['seconds'] / max(args.force_iterations, 1)
+    return {
+        'name': f'synthetic-{n_edges}',
+        'n_nodes': dataset.n_nodes,
+        'n_edges': n_edges,
+        'n_pairs': n_pairs,
+        'n_points': bundled.shape[1],
+        'finite': bool(np.isfinite(bundled).all()),
+        'seconds': time.perf_counter() - start,
+        'peak_rss_mb': max(stage['peak_rss_mb'] for stage in stages.values()),
+        'stages': stages,
+    }
+
+
+# Bundles the real graph with the settings of main.py and measures how far the result is from the stored
+# reference. The endpoints never move, so they have to match exactly. The interior points are not reproduced
+# exactly by the current bundler, their deviation is recorded so that a later run can check it did not change.
+def check_reference(args: argparse.Namespace) -> dict:
+    reference = np.load(args.reference) * REFERENCE_SCALE
+    settings = argparse.Namespace(**{**vars(args), **REFERENCE_SETTINGS})
+    dataset = AirlineDataset(args.graph)
+    layout = GraphLayout(dataset, 1000, 1000, 20)
+
+    start = time.perf_counter()
+    bundled = make_fdeb(settings).my_fdeb(layout.edge_coords.copy())
+    seconds = time.perf_counter() - start
+
+    if bundled.shape != reference.shape:
+        return {'reference': args.reference, 'seconds': seconds, 'passed': False,
+                'error': f'shape {bundled.shape} does not match the reference {reference.shape}'}
+
+    deviation = np.linalg.norm(bundled - reference, axis=-1)
+    endpoint_deviation = float(deviation[:, [0, -1]].max())
+    return {
+        'reference': args.reference,
+        'seconds': seconds,
+        'endpoint_deviation': endpoint_deviation,
+        'median_deviation': float(np.median(deviation)),
+        'p95_deviation': float(np.percentile(deviation, 95)),
+        'max_deviation': float(deviation.max()),
+        'passed': bool(np.isfinite(deviation).all() and endpoint_deviation < 1e-6),
+    }
+
+
+# Stages that got slower than threshold times the baseline, and reference deviations that moved
+def compare(results: dict, baseline: dict, threshold: float, min_seconds: float, tolerance: float) -> list:
+    regressions = []
+    baseline_cases = {case['name']: case for case in baseline.get('cases', [])}
+
+    for case in results['cases']:
+        base = baseline_cases.get(case['name'])
+        if base is None:
+            continue
+        stages = {**case['stages'], 'total': {'seconds': case['seconds']}}
+        base_stages = {**base['stages'], 'total': {'seconds': base['seconds']}}
+        for name, stage in stages.items():
+            if name not in base_stages or base_stages[name]['seconds'] < min_seconds:
+                continue
+            ratio = stage['seconds'] / base_stages[name]['seconds']
+            if ratio > threshold:
+                regressions.append(f"{case['name']} {name}: {base_stages[name]['seconds']:.3f} s -> "
+                                   f"{stage['seconds']:.3f} s ({ratio:.2f}x)")
+
+    current, previous = results.get('reference'), baseline.get('reference')
+    if current and previous and 'median_deviation' in previous:
+        for key in ('median_deviation', 'p95_deviation', 'max_deviation'):
+            if not abs(current.get(key, np.inf) - previous[key]) <= tolerance:
+                regressions.append(f"reference {key}: {previous[key]:.3f} -> {current.get(key, np.nan):.3f}")
+
+    return regressions
+
+
+# Runs func in a forked child and returns its result. The child is not a daemon like the workers of a Pool, so a
+# case bundled with --workers can start its own pool.
+def run_isolated(func, *args):
+    receiver, sender = mp.Pipe(duplex=False)
+
+    def target():
+        try:
+            sender.send((True, func(*args)))
+        except BaseException as e:
+            sender.send((False, f'{type(e).__name__}: {e}'))
+
+    process = mp.get_context('fork').Process(target=target)
+    process.start()
+    sender.close()
+    try:
+        ok, result = receiver.recv()
+    except EOFError:
+        # The child died without sending anything, e.g. killed for running out of memory
+        ok, result = False, None
+    process.join()
+    if not ok:
+        raise RuntimeError(f'{func.__name__} failed in its process: {result or f"exit code {process.exitcode}"}')
+    return result
+
+
+def environment() -> dict:
+    return {
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'machine': platform.machine(),
+        'cpu_count': os.cpu_count(),
+        'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+    }
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    results = {'environment': environment(), 'settings': vars(args), 'cases': []}
+
+    for n_edges in args.sizes:
+        case = run_isolated(run_case, n_edges, args)
+        results['cases'].append(case)
+
+        pairs = '' if case['n_pairs'] is None else f"{case['n_pairs']} compatible pairs, "
+        print(f"{case['name']}: {case['n_nodes']} nodes, {pairs}"
+              f"{case['seconds']:.2f} s, peak rss {case['peak_rss_mb']:.1f} MB"
+              + ('' if case['finite'] else ', the bundling diverged'))
+        for name, stage in case['stages'].items():
+            print(f"  {name:20s} {stage['seconds']:9.3f} s  peak alloc {stage['peak_alloc_mb']:9.1f} MB")
+
+    passed = True
+    if args.reference:
+        reference = check_reference(args)
+        results['reference'] = reference
+        passed = reference['passed']
+        print(f"reference: {'passed' if passed else 'FAILED'} " + ', '.join(
+            f'{key} {value:.3g}' for key, value in reference.items() if key.endswith('deviation')))
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, args.threshold, args.min_seconds, args.reference_tolerance)
+        results['regressions'] = regressions
+        print(f'{len(regressions)} regressions against {args.baseline}')
+        for regression in regressions:
+            print('  ' + regression)
+        passed = passed and not regressions
+
+    os.makedirs(os.path.dirname(args.output) or '.', exist_ok=True)
+    with open(args.output, 'w') as f:
+        json.dump(results, f, indent=2, default=str)
+
+    return 0 if passed else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,223 @@
+import argparse
+import json
+import os
+import resource
+import sys
+import time
+import tracemalloc
+
+import numpy as np
+
+from airline_dataset import AirlineDataset
+from bundle_cache import BundleCache
+from fdeb import EdgeBundler, Fdeb, FdebLog
+from kde_bundling import KdeBundling
+from layout import GraphLayout
+from multilevel import MultilevelFdeb
+import export
+
+
+# Headless bundling pipeline: load -> project -> bundle -> export for one or more GraphML files, e.g.
+#   python -m bundle data/airlines.graphml --n-cycles 6 --n-iter 60 --format npy svg png
+def parse_args(argv=None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description='Force-directed edge bundling without a display server.')
+    parser.add_argument('inputs', nargs='+', help='GraphML files to bundle')
+    parser.add_argument('--output-dir', default='output', help='directory for the exported files')
+    parser.add_argument('--format', nargs='+', choices=['npy', 'svg', 'png'], default=['npy'])
+    parser.add_argument('--width', type=float, default=1000, help='projection width')
+    parser.add_argument('--height', type=float, default=1000, help='projection height')
+    parser.add_argument('--scale-factor', type=float, default=20, help='projection scale factor')
+    parser.add_argument('--png-width', type=int, default=2000, help='width of the PNG export in pixels')
+    parser.add_argument('--svg-precision', type=float, default=1.0, help='SVG coordinate quantization step')
+    parser.add_argument('--svg-tolerance', type=float, default=0.0, help='SVG polyline simplification tolerance')
+    parser.add_argument('--no-airports', action='store_true', help='export only the edges')
+    parser.add_argument('--cache-dir', default=None, help='reuse and store results in this bundle cache')
+    parser.add_argument('--sidecar', action='store_true', help='read and write the binary dataset sidecar')
+    parser.add_argument('--report', default=None, help='write the stage timings of all inputs as JSON')
+    parser.add_argument('--log', action='store_true', help='write the bundling events as <input>.log.jsonl')
+    parser.add_argument('--snapshot-every', type=int, default=0,
+                        help='save the edges every n iterations as <input>.snapshots.npz')
+    add_fdeb_arguments(parser)
+    return check_fdeb_arguments(parser, parser.parse_args(argv))
+
+
+def add_hyperparameter_arguments(group, hyperparameters: dict, prefix: str = ''):
+    for name, value in hyperparameters.items():
+        option = '--' + prefix + name.replace('_', '-')
+        if isinstance(value, bool):
+            group.add_argument(option, action=argparse.BooleanOptionalAction, default=value)
+            continue
+        # Optional settings default to None and are numbers when given
+        kind = str if name == 'dtype' else float if value is None else type(value)
+        group.add_argument(option, type=kind, default=value)
+
+
+# Every hyperparameter and tuning knob of Fdeb and KdeBundling, with its current default, read back by make_fdeb.
+# KDE bundling options carry a kde- prefix, since some of its names have different defaults in Fdeb.
+def add_fdeb_arguments(parser: argparse.ArgumentParser):
+    defaults = Fdeb()
+    parser.add_argument('--engine', choices=['fdeb', 'kde'], default='fdeb', help='bundling engine')
+    group = parser.add_argument_group('bundling')
+    add_hyperparameter_arguments(group, defaults.hyperparameters())
+    group.add_argument('--n-levels', type=int, default=0, help='coarsening levels of the multilevel engine, 0 is flat')
+    group.add_argument('--metro-size', type=float, default=1 / 64, help='first level cell size relative to the layout')
+    group.add_argument('--refine-iter', type=int, default=10, help='relaxation iterations after every refinement')
+    group.add_argument('--out-of-core', default=None, metavar='DIR',
+                       help='keep the edge state and checkpoints in DIR and resume interrupted runs from it')
+    group.add_argument('--block-size', type=int, default=16384, help='edges per force block out of core')
+    group.add_argument('--workers', type=int, default=1, help='bundle with this many processes')
+    group.add_argument('--compat-block-size', type=int, default=defaults.compat_block_size)
+    group.add_argument('--pair-chunk-size', type=int, default=defaults.pair_chunk_size)
+    group.add_argument('--max-bytes', type=int, default=defaults.max_bytes)
+    group.add_argument('--dense', action='store_true', help='use the dense compatibility matrix')
+    group.add_argument('--no-spatial-pruning', action='store_true')
+    add_hyperparameter_arguments(parser.add_argument_group('kde bundling'), KdeBundling().hyperparameters(), 'kde-')
+
+
+# Rejects option combinations make_fdeb cannot honour, instead of silently dropping one of them
+def check_fdeb_arguments(parser: argparse.ArgumentParser, args: argparse.Namespace) -> argparse.Namespace:
+    # Each of these selects its own FDEB engine
+    engines = [option for option, given in (('--n-levels', args.n_levels > 0), ('--out-of-core', args.out_of_core),
+                                            ('--workers', args.workers > 1)) if given]
+    if len(engines) > 1:
+        parser.error(f'{engines[0]} and {engines[1]} select different engines and cannot be combined')
+    if args.workers > 1 and args.dense:
+        parser.error('--workers shards the sparse compatible pairs and cannot be combined with --dense')
+    if args.out_of_core and args.dense:
+        parser.error('--out-of-core streams the sparse compatible pairs and cannot be combined with --dense')
+    if args.engine == 'kde':
+        for option, given in (('--workers', args.workers > 1), ('--out-of-core', args.out_of_core),
+                              ('--n-levels', args.n_levels > 0)):
+            if given:
+                parser.error(f'{option} only applies to FDEB and cannot be combined with --engine kde')
+    if args.out_of_core and args.adaptive and args.step_adaptation:
+        parser.error('--out-of-core keeps the scheduled step size and cannot be combined with --step-adaptation')
+    return args
+
+
+def make_fdeb(args: argparse.Namespace) -> EdgeBundler:
+    if args.engine == 'kde':
+        fdeb = KdeBundling()
+        for name in fdeb.hyperparameters():
+            setattr(fdeb, name, getattr(args, 'kde_' + name))
+        return fdeb
+
+    if args.n_levels > 0:
+        fdeb = MultilevelFdeb()
+    elif args.out_of_core:
+        from fdeb_outofcore import OutOfCoreFdeb
+        fdeb = OutOfCoreFdeb(args.out_of_core)
+        fdeb.block_size = args.block_size
+    elif args.workers > 1:
+        from fdeb_parallel import ParallelFdeb
+        fdeb = ParallelFdeb(args.workers)
+    else:
+        fdeb = Fdeb()
+
+    for name in fdeb.hyperparameters():
+        setattr(fdeb, name, getattr(args, name))
+    fdeb.dtype = np.dtype(args.dtype).type
+    fdeb.compat_block_size = args.compat_block_size
+    fdeb.pair_chunk_size = args.pair_chunk_size
+    fdeb.max_bytes = args.max_bytes
+    fdeb.sparse_compat = not args.dense
+    fdeb.spatial_pruning = not args.no_spatial_pruning
+    return fdeb
+
+
+class StageTimer:
+    def __init__(self):
+        self.stages = {}
+
+    def run(self, name: str, func, *args, **kwargs):
+        tracemalloc.reset_peak()
+        start = time.perf_counter()
+        result = func(*args, **kwargs)
+        self.stages[name] = {
+            'seconds': time.perf_counter() - start,
+            'peak_alloc_mb': tracemalloc.get_traced_memory()[1] / 2 ** 20,
+            # ru_maxrss is in kilobytes on Linux and is the peak of the whole process so far
+            'peak_rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 2 ** 10,
+        }
+        return result
+
+
+def run(path: str, args: argparse.Namespace) -> dict:
+    timer = StageTimer()
+    stem = os.path.splitext(os.path.basename(path))[0]
+    fdeb = make_fdeb(args)
+    os.makedirs(args.output_dir, exist_ok=True)
+    if args.out_of_core and hasattr(fdeb, 'directory'):
+        fdeb.directory = os.path.join(args.out_of_core, stem)
+    if args.log:
+        fdeb.callbacks.append(FdebLog(os.path.join(args.output_dir, f'{stem}.log.jsonl')))
+    fdeb.snapshot_every = args.snapshot_every
+
+    dataset = timer.run('load', AirlineDataset, path, sidecar=args.sidecar)
+    layout = timer.run('project', GraphLayout, dataset, args.width, args.height, args.scale_factor)
+
+    try:
+        if args.cache_dir:
+            cache = BundleCache(args.cache_dir)
+            bundled = timer.run('bundle', cache.bundle, fdeb, layout.edge_coords, layout.projection())
+        else:
+            bundled = timer.run('bundle', fdeb.my_fdeb, layout.edge_coords.copy())
+    finally:
+        for callback in fdeb.callbacks:
+            callback.close()
+
+    report = {'input': path, 'n_nodes': dataset.n_nodes, 'n_edges': dataset.n_edges, 'iterations': fdeb.iterations,
+              'iterations_saved': fdeb.iterations_saved, 'finite': bool(np.isfinite(bundled).all()),
+              'stages': timer.stages}
+    # A diverged bundling has nothing worth writing
+    if not report['finite']:
+        return report
+
+    # Snapshots of different cycles have different numbers of subdivision points, so each one is its own array
+    if fdeb.snapshots:
+        np.savez(os.path.join(args.output_dir, f'{stem}.snapshots.npz'),
+                 **{f'snapshot_{i:04d}': snapshot for i, snapshot in enumerate(fdeb.snapshots)})
+
+    writers = {'npy': export.save_npy, 'svg': export.save_svg, 'png': export.save_png}
+    options = {
+        'npy': {},
+        'svg': {'precision': args.svg_precision, 'tolerance': args.svg_tolerance},
+        'png': {'width': args.png_width},
+    }
+    for fmt in args.format:
+        target = os.path.join(args.output_dir, f'{stem}.{fmt}')
+        if fmt != 'npy' and not args.no_airports:
+            options[fmt].update(layout=layout, names=dataset.names)
+        timer.run(f'export_{fmt}', writers[fmt], target, bundled, **options[fmt])
+
+    return report
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    if 'png' in args.format:
+        os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+
+    tracemalloc.start()
+    reports = []
+    for path in args.inputs:
+        report = run(path, args)
+        reports.append(report)
+
+        if not report['finite']:
+            print(f"{path}: the bundling diverged to non-finite coordinates, try a larger --coord-scale",
+                  file=sys.stderr)
+        print(f"{path}: {report['n_nodes']} nodes, {report['n_edges']} edges"
+              + (f", {report['iterations_saved']} iterations saved" if args.adaptive else ''))
+        for name, stage in report['stages'].items():
+            print(f"  {name:12s} {stage['seconds']:9.3f} s  peak alloc {stage['peak_alloc_mb']:9.1f} MB  "
+                  f"peak rss {stage['peak_rss_mb']:9.1f} MB")
+
+    if args.report:
+        with open(args.report, 'w') as f:
+            json.dump(reports, f, indent=2)
+    return 0 if all(report['finite'] for report in reports) else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,92 @@
+import hashlib
+import json
+import os
+import tempfile
+
+import numpy as np
+
+# Bump when a change to the bundling code makes previously cached results invalid
+CACHE_VERSION = 2
+
+
+# Hash of the input edge coordinates, the projection they were produced with and the engine with every one of its
+# hyperparameters, which together determine the bundling result
+def bundle_key(fdeb, edges: np.ndarray, projection: dict = None) -> str:
+    edges = np.ascontiguousarray(edges, dtype=np.float64)
+    description = {
+        'version': CACHE_VERSION,
+        'engine': type(fdeb).__name__,
+        'hyperparameters': fdeb.hyperparameters(),
+        'projection': projection,
+        'shape': edges.shape,
+    }
+
+    digest = hashlib.sha256(json.dumps(description, sort_keys=True).encode())
+    digest.update(edges.tobytes())
+    return digest.hexdigest()
+
+
+# Content-addressed store of bundling results. Entries are keyed by bundle_key, so a changed input can never be
+# served a stale bundling. The directory is kept under max_bytes by evicting the least recently used entries.
+class BundleCache:
+    def __init__(self, directory: str, max_bytes: int = 1 << 30):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        os.makedirs(self.directory, exist_ok=True)
+
+    def key(self, fdeb, edges: np.ndarray, projection: dict = None) -> str:
+        return bundle_key(fdeb, edges, projection)
+
+    def path(self, key: str) -> str:
+        return os.path.join(self.directory, key + '.npy')
+
+    # Returns the cached result memory-mapped read-only, or None on a miss
+    def load(self, key: str):
+        path = self.path(key)
+        try:
+            bundled = np.load(path, mmap_mode='r')
+        except FileNotFoundError:
+            return None
+
+        # The modification time doubles as the last access time for LRU eviction
+        os.utime(path)
+        return bundled
+
+    def store(self, key: str, bundled: np.ndarray) -> np.ndarray:
+        # Write to a temporary file first so that concurrent readers never see a partial entry
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        with os.fdopen(fd, 'wb') as f:
+            np.save(f, bundled)
+        os.replace(tmp_path, self.path(key))
+
+        self.evict(keep=key)
+        return self.load(key)
+
+    def bundle(self, fdeb, edges: np.ndarray, projection: dict = None) -> np.ndarray:
+        key = self.key(fdeb, edges, projection)
+        bundled = self.load(key)
+        if bundled is None:
+            bundled = fdeb.my_fdeb(np.array(edges, dtype=np.float64))
+            # A diverged bundling is returned for the caller to report, but never served again
+            if np.isfinite(bundled).all():
+                bundled = self.store(key, bundled)
+        return bundled
+
+    def evict(self, keep: str = None):
+        entries = []
+        for name in os.listdir(self.directory):
+            if name.endswith('.npy'):
+                stat = os.stat(os.path.join(self.directory, name))
+                entries.append((stat.st_mtime, stat.st_size, name))
+
+        total = sum(size for _, size, _ in entries)
+        for _, size, name in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            if name == f'{keep}.npy':
+                continue
+            try:
+                os.remove(os.path.join(self.directory, name))
+            except FileNotFoundError:
+                pass
+            total -= size
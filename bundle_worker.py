@@ -0,0 +1,45 @@
+import numpy as np
+from PySide6.QtCore import QThread, Signal
+
+from bundle_cache import BundleCache
+from edge_layer import detail_levels
+from fdeb import EdgeBundler
+
+
+class BundlingCancelled(Exception):
+    pass
+
+
+# Bundles on a background thread so that the window stays responsive. The edges of every completed cycle are sent
+# with progress and the result with done, both with their detail_levels, so the edge layer never simplifies on the
+# UI thread. With a cache, a finished bundling is stored and a cached one is returned right away.
+# requestInterruption stops the bundling at its next iteration, after which nothing more is sent.
+class BundleWorker(QThread):
+    progress = Signal(object, object, int)  # edges, levels of detail, cycle
+    done = Signal(object, object)  # edges, levels of detail
+
+    def __init__(self, fdeb: EdgeBundler, edges: np.ndarray, cache: BundleCache = None, projection: dict = None,
+                 parent=None):
+        super(BundleWorker, self).__init__(parent)
+        self.fdeb = fdeb
+        self.edges = edges
+        self.cache = cache
+        self.projection = projection
+        self.fdeb.callbacks.append(self.on_event)
+
+    def on_event(self, event: dict):
+        if self.isInterruptionRequested():
+            raise BundlingCancelled()
+        if event['event'] == 'cycle':
+            self.progress.emit(event['edges'], detail_levels(event['edges']), event['cycle'])
+
+    def run(self):
+        try:
+            if self.cache is not None:
+                bundled = self.cache.bundle(self.fdeb, self.edges, self.projection)
+            else:
+                bundled = self.fdeb.my_fdeb(self.edges.copy())
+        except BundlingCancelled:
+            return
+        if not self.isInterruptionRequested():
+            self.done.emit(bundled, detail_levels(bundled))
@@ -0,0 +1,135 @@
+import numpy as np
+from PySide6.QtCore import QLineF, QRectF
+from PySide6.QtGui import QPainterPath
+from PySide6.QtWidgets import QGraphicsItem, QStyleOptionGraphicsItem
+
+from polyline import significance
+from spatial_index import BoxIndex
+
+# Douglas-Peucker tolerances in scene units of the precomputed levels of detail
+LOD_TOLERANCES = (0.5, 1, 2, 4, 8, 16, 32, 64)
+
+
+# Lines of the polylines reduced to the points of the (E x P) keep mask and the offsets of every edge's lines
+def level_lines(edges: np.ndarray, keep: np.ndarray) -> tuple:
+    points = edges[keep]
+    counts = keep.sum(axis=1) - 1
+
+    # Consecutive kept points form a segment unless the second one starts the next edge
+    same_edge = np.ones(len(points) - 1, dtype=bool) if len(points) else np.zeros(0, dtype=bool)
+    same_edge[np.cumsum(counts + 1)[:-1] - 1] = False
+    segments = np.concatenate([points[:-1], points[1:]], axis=-1)[same_edge]
+
+    offsets = np.zeros(len(edges) + 1, dtype=np.int64)
+    np.cumsum(counts, out=offsets[1:])
+    return [QLineF(x1, y1, x2, y2) for x1, y1, x2, y2 in segments.tolist()], offsets
+
+
+# Lines and line offsets of the (E x P x 2) edges at every level of detail, keyed by tolerance, 0 being the full
+# polylines. All levels come from one Douglas-Peucker pass, see polyline.significance. Needs no scene, so it can run
+# on the bundling thread.
+def detail_levels(edges: np.ndarray) -> dict:
+    edges = np.asarray(edges, dtype=np.float64)
+    point_significance = significance(edges)
+    levels = {0: level_lines(edges, np.ones(edges.shape[:2], dtype=bool))}
+    for tolerance in LOD_TOLERANCES:
+        levels[tolerance] = level_lines(edges, point_significance > tolerance)
+    return levels
+
+
+# Draws all bundled edges of an (E x P x 2) array as a single scene item. Every segment is kept as its own line,
+# so overlapping translucent edges still add up the same way separate line items did, but the whole layer is
+# painted with one drawLines call. Selected and hovered edges are drawn again on top with their own pens.
+# Paints only touch the edges whose bounding boxes overlap the exposed rectangle and draw them simplified with the
+# largest tolerance that stays below lod_pixels on screen, so zoomed out views draw far fewer segments and zoomed in
+# ones only the visible edges.
+class EdgeLayer(QGraphicsItem):
+    def __init__(self, edges: np.ndarray, pen, selected_pen, hover_pen=None):
+        super(EdgeLayer, self).__init__()
+        self.pen = pen
+        self.selected_pen = selected_pen
+        self.hover_pen = hover_pen or selected_pen
+        self.lines = []
+        self.selected_lines = []
+        self.selected_edges = []
+        self.hovered_lines = []
+        self.hovered_edges = []
+        self.segments_per_edge = 0
+        self.rect = QRectF()
+        self.edges = np.zeros((0, 2, 2))
+        self.index = BoxIndex(np.zeros((0, 4)))
+        self.lod_pixels = 0.5
+        self.levels = {}  # tolerance -> lines and per-edge line offsets
+        self.setZValue(-50)  # Set a low Z-value for edges
+        self.setFlag(QGraphicsItem.ItemUsesExtendedStyleOption)  # paint gets the exposed rectangle
+        self.set_edges(edges)
+
+    # Replaces the edges. levels are their detail_levels, which the bundling thread builds along with the edges, so
+    # neither this nor painting simplifies on the UI thread.
+    def set_edges(self, edges: np.ndarray, levels: dict = None):
+        self.prepareGeometryChange()
+        edges = np.asarray(edges, dtype=np.float64)
+        self.segments_per_edge = edges.shape[1] - 1
+        self.levels = detail_levels(edges) if levels is None else levels
+        self.lines = self.levels[0][0]
+        self.edges = edges
+        self.index = BoxIndex(np.concatenate([edges.min(axis=1), edges.max(axis=1)], axis=-1))
+
+        if len(edges):
+            (left, top), (right, bottom) = edges.min(axis=(0, 1)), edges.max(axis=(0, 1))
+            margin = self.pen.widthF() + 1
+            self.rect = QRectF(left - margin, top - margin, right - left + 2 * margin, bottom - top + 2 * margin)
+        else:
+            self.rect = QRectF()
+
+        self.set_selected(self.selected_edges)
+        self.set_hovered(self.hovered_edges)
+
+    # Coarsest level whose tolerance, at the given scale, stays below lod_pixels screen pixels
+    def level_for_scale(self, scale: float) -> tuple:
+        tolerance = max([t for t in LOD_TOLERANCES if t * scale <= self.lod_pixels], default=0)
+        return self.levels[tolerance]
+
+    # Lines of the edges whose bounding boxes overlap the rectangle, or of all edges if they all do
+    def visible_lines(self, lines: list, offsets: np.ndarray, rect: QRectF) -> list:
+        margin = self.pen.widthF() + 1
+        visible = self.index.query(rect.left() - margin, rect.top() - margin, rect.right() + margin,
+                                   rect.bottom() + margin)
+        if len(visible) == len(self.edges):
+            return lines
+        return [line for idx in visible.tolist() for line in lines[offsets[idx]:offsets[idx + 1]]]
+
+    def _edge_lines(self, edge_indices) -> list:
+        n = self.segments_per_edge
+        return [line for idx in edge_indices for line in self.lines[idx * n:(idx + 1) * n]]
+
+    def set_selected(self, edge_indices):
+        self.selected_edges = [int(idx) for idx in edge_indices]
+        self.selected_lines = self._edge_lines(self.selected_edges)
+        self.update()
+
+    def set_hovered(self, edge_indices):
+        self.hovered_edges = [int(idx) for idx in edge_indices]
+        self.hovered_lines = self._edge_lines(self.hovered_edges)
+        self.update()
+
+    def boundingRect(self) -> QRectF:
+        return self.rect
+
+    # Edges are not pickable, clicks go to the airports below and above them
+    def shape(self) -> QPainterPath:
+        return QPainterPath()
+
+    def paint(self, painter, option, widget=None):
+        lines, offsets = self.level_for_scale(QStyleOptionGraphicsItem.levelOfDetailFromTransform(
+            painter.worldTransform()))
+        painter.setPen(self.pen)
+        painter.drawLines(self.visible_lines(lines, offsets, option.exposedRect))
+
+        if self.hovered_lines:
+            painter.setPen(self.hover_pen)
+            painter.drawLines(self.hovered_lines)
+
+        if self.selected_lines:
+            painter.setPen(self.selected_pen)
+            painter.drawLines(self.selected_lines)
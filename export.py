@@ -0,0 +1,121 @@
+import numpy as np
+
+from polyline import simplify
+
+BACKGROUND = (0, 0, 128, 255)
+EDGE_COLOR = (255, 0, 0, 60)
+AIRPORT_COLOR = (255, 255, 0, 160)
+LABEL_COLOR = (255, 255, 255, 255)
+
+
+def save_npy(path: str, edges: np.ndarray):
+    np.save(path, edges)
+
+
+def _bounds(edges: np.ndarray, layout=None, margin: float = 20) -> tuple:
+    (left, top), (right, bottom) = edges.min(axis=(0, 1)), edges.max(axis=(0, 1))
+    if layout is not None:
+        left, top = min(left, layout.x.min()), min(top, layout.y.min())
+        right, bottom = max(right, layout.x.max()), max(bottom, layout.y.max())
+    return left - margin, top - margin, right + margin, bottom + margin
+
+
+def _svg_fill(color: tuple) -> str:
+    return f'fill="#{color[0]:02x}{color[1]:02x}{color[2]:02x}" fill-opacity="{color[3] / 255:.3g}"'
+
+
+# Streams the bundled edges straight from the array into an SVG file, one <path> per edge so that translucent
+# edges still add up. Coordinates are quantized to multiples of precision scene units and written as integers
+# relative to the previous point, polylines are simplified with the given Douglas-Peucker tolerance first and
+# edges are processed chunk by chunk, so memory-mapped inputs are never loaded as a whole.
+def save_svg(path: str, edges: np.ndarray, layout=None, names=None, precision: float = 1.0, tolerance: float = 0.0,
+             chunk_size: int = 4096):
+    left, top, right, bottom = _bounds(edges, layout)
+    stroke = f'#{EDGE_COLOR[0]:02x}{EDGE_COLOR[1]:02x}{EDGE_COLOR[2]:02x}'
+
+    with open(path, 'w') as f:
+        f.write(f'<svg xmlns="http://www.w3.org/2000/svg" viewBox="{left:.6g} {top:.6g} {right - left:.6g} '
+                f'{bottom - top:.6g}">\n')
+        f.write(f'<rect x="{left:.6g}" y="{top:.6g}" width="{right - left:.6g}" height="{bottom - top:.6g}" '
+                f'{_svg_fill(BACKGROUND)}/>\n')
+        f.write(f'<g fill="none" stroke="{stroke}" stroke-opacity="{EDGE_COLOR[3] / 255:.3g}" '
+                f'stroke-width="{1 / precision:.6g}" transform="scale({precision:.6g})">\n')
+
+        for start in range(0, len(edges), chunk_size):
+            chunk = np.asarray(edges[start:start + chunk_size], dtype=np.float64)
+            points = np.round(chunk / precision).astype(np.int64)
+            keep = simplify(chunk, tolerance) if tolerance > 0 else np.ones(chunk.shape[:2], dtype=bool)
+
+            # First point absolute, all following ones relative to their predecessor
+            kept = points[keep]
+            deltas = np.diff(kept, axis=0, prepend=np.zeros((1, 2), dtype=np.int64))
+            counts = keep.sum(axis=1)
+            starts = np.cumsum(counts) - counts
+            deltas[starts] = kept[starts]
+
+            tokens = list(map(str, deltas.ravel().tolist()))
+            for first, count in zip((2 * starts).tolist(), (2 * counts).tolist()):
+                move = ' '.join(tokens[first:first + 2])
+                lines = ' '.join(tokens[first + 2:first + count])
+                f.write(f'<path d="M{move}l{lines}"/>\n')
+
+        f.write('</g>\n')
+
+        if layout is not None:
+            f.write(f'<g {_svg_fill(AIRPORT_COLOR)}>\n')
+            for x, y, size in zip(layout.x.tolist(), layout.y.tolist(), layout.sizes.tolist()):
+                f.write(f'<circle cx="{x:.1f}" cy="{y:.1f}" r="{size / 2:.1f}"/>\n')
+            f.write('</g>\n')
+
+        if layout is not None and names is not None:
+            f.write(f'<g {_svg_fill(LABEL_COLOR)} font-family="sans-serif">\n')
+            for x, y, size, name in zip(layout.x.tolist(), layout.y.tolist(), layout.sizes.tolist(), names):
+                f.write(f'<text x="{x + 10:.1f}" y="{y + 2:.1f}" font-size="{12 * (1 + (size - 10) / 20):.1f}">'
+                        f'{name}</text>\n')
+            f.write('</g>\n')
+
+        f.write('</svg>\n')
+
+
+# Renders into an off-screen QImage of the given width in pixels, so no window or display server is needed.
+# Edges are drawn chunk by chunk.
+def save_png(path: str, edges: np.ndarray, layout=None, names=None, width: int = 2000, chunk_size: int = 4096):
+    from PySide6.QtCore import QLineF, QPointF
+    from PySide6.QtGui import QBrush, QColor, QGuiApplication, QImage, QPainter, QPen
+
+    # Text rendering needs a gui application, headless runs use the offscreen platform
+    app = QGuiApplication.instance() or QGuiApplication(['export'])
+
+    left, top, right, bottom = _bounds(edges, layout)
+    scale = width / max(right - left, 1e-9)
+    height = max(1, int(np.ceil((bottom - top) * scale)))
+
+    image = QImage(width, height, QImage.Format_ARGB32_Premultiplied)
+    image.fill(QColor(*BACKGROUND))
+    painter = QPainter(image)
+    painter.setRenderHint(QPainter.Antialiasing)
+    painter.scale(scale, scale)
+    painter.translate(-left, -top)
+    painter.setPen(QPen(QColor(*EDGE_COLOR)))
+
+    for start in range(0, len(edges), chunk_size):
+        chunk = np.asarray(edges[start:start + chunk_size], dtype=np.float64)
+        segments = np.concatenate([chunk[:, :-1], chunk[:, 1:]], axis=-1).reshape(-1, 4)
+        painter.drawLines([QLineF(x1, y1, x2, y2) for x1, y1, x2, y2 in segments.tolist()])
+
+    if layout is not None:
+        painter.setPen(QPen(QColor(*AIRPORT_COLOR)))
+        painter.setBrush(QBrush(QColor(*AIRPORT_COLOR)))
+        for x, y, size in zip(layout.x.tolist(), layout.y.tolist(), layout.sizes.tolist()):
+            painter.drawEllipse(QPointF(x, y), size / 2, size / 2)
+
+    if layout is not None and names is not None:
+        painter.setPen(QPen(QColor(*LABEL_COLOR)))
+        font = painter.font()
+        for x, y, size, name in zip(layout.x.tolist(), layout.y.tolist(), layout.sizes.tolist(), names):
+            font.setPointSizeF(9 * (1 + (size - 10) / 20))
+            painter.setFont(font)
+            painter.drawText(QPointF(x + 10, y + 2), str(name))
+
+    painter.end()
+    image.save(path)
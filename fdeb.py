@@ -1,11 +1,71 @@
-import numpy as np
+import abc
+import json
 import math
+import time
 
+import numpy as np
 from tqdm import tqdm
 
+# Size of the larger side of the layout in the coordinates the forces are computed in, unless coord_scale is given
+FRAME_EXTENT = 30.0
+
 
-class Fdeb:
+# What the bundling engines share: the run counters, the event callbacks with their snapshots and the resampling
+# of polylines. An engine adds its hyperparameters and my_fdeb, which bundles (E x P x 2) edges in input coordinates.
+class EdgeBundler(abc.ABC):
     def __init__(self):
+        self.iterations = 0  # iterations run by the last my_fdeb
+        self.iterations_saved = 0  # scheduled iterations the last run skipped by stopping early
+        # Called with an event dict at the start and end of a run and after every cycle and iteration
+        self.callbacks = []
+        self.snapshot_every = 0  # copy the edges into snapshots every snapshot_every iterations, 0 disables it
+        self.snapshots = []
+
+    # Parameters that influence the bundling result, as opposed to the ones that only tune speed or memory
+    @abc.abstractmethod
+    def hyperparameters(self) -> dict:
+        pass
+
+    @abc.abstractmethod
+    def my_fdeb(self, edges):
+        pass
+
+    # Instrumentation is only computed when someone listens, an unmonitored run does no extra work
+    def monitored(self) -> bool:
+        return bool(self.callbacks) or self.snapshot_every > 0
+
+    def emit(self, event: dict):
+        for callback in self.callbacks:
+            callback(event)
+
+    # Resamples every polyline at num_points points evenly spaced along its arc length. Segment lengths are taken
+    # in float64 whatever the edge dtype, so float32 runs place the new points as precisely as float64 ones.
+    def subdivide_edges(self, edges: np.ndarray, num_points: int) -> np.ndarray:
+        segment_lens = np.linalg.norm(np.diff(edges.astype(np.float64, copy=False), axis=1), axis=-1)
+        cum_segment_lens = np.zeros(edges.shape[:2])
+        np.cumsum(segment_lens, axis=1, out=cum_segment_lens[:, 1:])
+
+        # Segment i - 1 holds each new point, the last point falls back to the end of the final segment
+        total_lens = cum_segment_lens[:, -1]
+        t = np.linspace(0, 1, num=num_points, endpoint=True)
+        desired_lens = t * total_lens[:, None]
+        i = np.argmax(desired_lens[:, None] < cum_segment_lens[..., None], axis=1)
+        pct = (desired_lens - np.take_along_axis(cum_segment_lens, i - 1, axis=-1)) / (
+                np.take_along_axis(segment_lens, i - 1, axis=-1) + 1e-8
+        )
+
+        row_indices = np.arange(edges.shape[0])[:, None]
+        new_points = (
+                (1 - pct[..., None]) * edges[row_indices, i - 1]
+                + pct[..., None] * edges[row_indices, i]
+        )
+
+        return new_points
+
+
+class Fdeb(EdgeBundler):
+    def __init__(self):
+        super(Fdeb, self).__init__()
         self.K = 0.1
         self.n_iter = 30
         self.n_iter_reduction = 2 / 3
@@ -15,177 +75,620 @@ class Fdeb:
         self.initial_segpoints = 1
         self.segpoint_increase = 2
         self.compat_threshold = 0.5
+        self.compat_block_size = 256
+        self.sparse_compat = True
+        self.pair_chunk_size = 16384
+        self.spatial_pruning = True
+        self.max_bytes = None
+        self.dtype = np.float64
+        self.coord_scale = None  # input units per bundling unit, None derives it from the layout with frame
+        self.scale = 1.0  # coord_scale of the current run
+        self.workspace = None
+        self.edge_compatibilities = None
+        self.incremental_iter = 10
+        # Adaptive mode: a cycle stops early once the rms or max net displacement of the last two iterations falls
+        # below tolerance, in bundling coordinates, where the layout is FRAME_EXTENT across. With step_adaptation
+        # every edge also gets its own step size, see adapt_steps.
+        self.adaptive = False
+        self.tolerance = 0.03
+        self.tolerance_norm = 'rms'
+        self.min_iter = 3
+        self.step_adaptation = False
+        self.step_increase = 1.2
+        self.step_decrease = 0.5
+        self.center = None
+
+    def hyperparameters(self) -> dict:
+        return {
+            'K': self.K,
+            'n_iter': self.n_iter,
+            'n_iter_reduction': self.n_iter_reduction,
+            'lr': self.lr,
+            'lr_reduction': self.lr_reduction,
+            'n_cycles': self.n_cycles,
+            'initial_segpoints': self.initial_segpoints,
+            'segpoint_increase': self.segpoint_increase,
+            'compat_threshold': self.compat_threshold,
+            'dtype': np.dtype(self.dtype).name,
+            'coord_scale': self.coord_scale,
+            'adaptive': self.adaptive,
+            'tolerance': self.tolerance,
+            'tolerance_norm': self.tolerance_norm,
+            'min_iter': self.min_iter,
+            'step_adaptation': self.step_adaptation,
+            'step_increase': self.step_increase,
+            'step_decrease': self.step_decrease,
+        }
+
+    def get_edge_compatibility(self, edges: np.ndarray) -> np.ndarray:
+        n_edges = edges.shape[0]
+        src, dst = edges[:, 0], edges[:, -1]
+        compatibility_matrix = np.zeros((n_edges, n_edges), dtype=np.int64)
+
+        # Scores are computed for a block of rows against all edges at a time, so the temporaries
+        # are (block_size x E) instead of (E x E x P x 2)
+        for start in range(0, n_edges, self.compat_block_size):
+            stop = min(start + self.compat_block_size, n_edges)
+            scores = self.pair_compatibility(src[start:stop, None], dst[start:stop, None], src[None, :], dst[None, :])
+            compatibility_matrix[start:stop] = scores > self.compat_threshold
 
-    def get_edge_compatibility(self, edges: np.ndarray):
-        vec = np.array([edge[-1] - edge[0] for edge in edges])
-        vec_norm = np.linalg.norm(vec, axis=1, keepdims=True)
+        return compatibility_matrix
 
-        # Angle compatability
-        compat_angle = np.abs(np.matmul(vec, np.transpose(vec)) / (np.matmul(vec_norm, np.transpose(vec_norm)) + 1e-8))
+    # Same as get_edge_compatibility, but returns only the compatible pairs (i, j) with i < j as an (n_pairs x 2)
+    # index array. The diagonal is dropped since an edge exerts no force on itself.
+    def get_sparse_edge_compatibility(self, edges: np.ndarray) -> np.ndarray:
+        n_edges = edges.shape[0]
+
+        # Candidates are generated and scored for compat_block_size edges at a time, so the expanded candidate
+        # lists of a block bound the memory instead of those of all edges
+        if self.spatial_pruning and self.compat_threshold > 0:
+            pairs = [self._score_candidate_pairs(edges, self.get_candidate_pairs(edges, start,
+                                                                                 start + self.compat_block_size))
+                     for start in range(0, n_edges, self.compat_block_size)]
+            if not pairs:
+                return np.zeros((0, 2), dtype=np.int32)
+            pairs = np.concatenate(pairs, axis=0)
+            keys = np.sort(pairs[:, 0].astype(np.int64) * n_edges + pairs[:, 1])
+            return np.stack([keys // n_edges, keys % n_edges], axis=-1).astype(np.int32)
+
+        src, dst = edges[:, 0], edges[:, -1]
+        pairs = []
+
+        for start in range(0, n_edges, self.compat_block_size):
+            stop = min(start + self.compat_block_size, n_edges)
+            scores = self.pair_compatibility(src[start:stop, None], dst[start:stop, None], src[None, start:],
+                                             dst[None, start:])
+            rows, cols = np.nonzero(np.triu(scores > self.compat_threshold, k=1))
+            pairs.append(np.stack([rows + start, cols + start], axis=-1))
+
+        return np.concatenate(pairs, axis=0).astype(np.int32) if pairs else np.zeros((0, 2), dtype=np.int32)
+
+    # Angle and visibility compatibility are at most 1, so a pair can only pass the threshold if the product of its
+    # length and distance terms does, which in particular needs midpoint_dist < reach * l_avg. Edges are bucketed into
+    # power-of-two length classes and each class gets a uniform grid over midpoints whose cell size is the largest
+    # reach in that class, so every surviving pair lies in neighbouring cells of the grid of its longer edge.
+    # Every pair is found from exactly one of its edges, restricting those to [start, stop) returns one block of
+    # the pairs, so that blocks over consecutive ranges add up to all of them.
+    def get_candidate_pairs(self, edges: np.ndarray, start: int = 0, stop: int = None) -> np.ndarray:
+        midpoint = (edges[:, 0] + edges[:, -1]) / 2
+        lengths = np.linalg.norm(edges[:, -1] - edges[:, 0], axis=-1)
+        reach = (1 / self.compat_threshold - 1) * (1 + 1e-6)
+        if lengths.size == 0 or reach * lengths.max() <= 0:
+            return np.zeros((0, 2), dtype=np.int32)
+
+        # Edges shorter than 2^-20 of the longest one are lumped into the lowest class
+        levels = np.floor(np.log2(np.maximum(lengths, lengths.max() * 2.0 ** -20))).astype(np.int64)
+        origin = midpoint.min(axis=0)
+        candidates = []
+
+        for level in np.unique(levels):
+            cell = reach * 2.0 ** (level + 1)
+            queries = np.nonzero(levels[start:stop] == level)[0] + start
+            if len(queries) == 0:
+                continue
+            targets = np.nonzero(levels <= level)[0]
+
+            cells = np.floor((midpoint - origin) / cell).astype(np.int64) + 1
+            n_rows = cells[:, 1].max() + 2
+            target_keys = cells[targets, 0] * n_rows + cells[targets, 1]
+            order = np.argsort(target_keys, kind='stable')
+            sorted_keys = target_keys[order]
+
+            for dx in (-1, 0, 1):
+                for dy in (-1, 0, 1):
+                    query_keys = (cells[queries, 0] + dx) * n_rows + cells[queries, 1] + dy
+                    lo = np.searchsorted(sorted_keys, query_keys, side='left')
+                    hi = np.searchsorted(sorted_keys, query_keys, side='right')
+                    counts = hi - lo
+                    if counts.sum() == 0:
+                        continue
+
+                    # Expand each query's [lo, hi) range of matching targets into explicit pairs
+                    p = np.repeat(queries, counts)
+                    offsets = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+                    q = targets[order[np.repeat(lo, counts) + offsets]]
+
+                    # Pairs within the same length class are found from both ends, keep only one of them
+                    keep = (levels[q] < level) | (p < q)
+                    p, q = p[keep], q[keep]
+
+                    l_avg = (lengths[p] + lengths[q]) / 2
+                    l_min = np.minimum(lengths[p], lengths[q])
+                    l_max = np.maximum(lengths[p], lengths[q])
+                    compat_length = 2 / ((l_avg / (l_min + 1e-8)) + (l_max / (l_avg + 1e-8)) + 1e-8)
+                    midpoint_dist = np.linalg.norm(midpoint[p] - midpoint[q], axis=-1)
+                    compat_dist = l_avg / (l_avg + midpoint_dist + 1e-8)
+
+                    keep = compat_length * compat_dist > self.compat_threshold * (1 - 1e-6)
+                    candidates.append(np.minimum(p, q)[keep] * len(edges) + np.maximum(p, q)[keep])
+
+        if not candidates:
+            return np.zeros((0, 2), dtype=np.int32)
+
+        keys = np.sort(np.concatenate(candidates))
+        return np.stack([keys // len(edges), keys % len(edges)], axis=-1).astype(np.int32)
+
+    def _score_candidate_pairs(self, edges: np.ndarray, candidates: np.ndarray) -> np.ndarray:
+        src, dst = edges[:, 0], edges[:, -1]
+        pairs = []
+
+        for start in range(0, candidates.shape[0], self.pair_chunk_size):
+            p, q = candidates[start:start + self.pair_chunk_size].T
+            scores = self.pair_compatibility(src[p], dst[p], src[q], dst[q])
+            pairs.append(candidates[start:start + self.pair_chunk_size][scores > self.compat_threshold])
+
+        return np.concatenate(pairs, axis=0) if pairs else np.zeros((0, 2), dtype=np.int32)
+
+    # Compatibility score of edges p and q given their endpoints. All inputs are (..., 2) arrays that broadcast
+    # against each other, so the same code scores a block of rows against all edges or an explicit list of pairs.
+    @staticmethod
+    def pair_compatibility(src_p: np.ndarray, dst_p: np.ndarray, src_q: np.ndarray, dst_q: np.ndarray) -> np.ndarray:
+        vec_p = dst_p - src_p
+        vec_q = dst_q - src_q
+        norm_p = np.linalg.norm(vec_p, axis=-1)
+        norm_q = np.linalg.norm(vec_q, axis=-1)
+
+        # Angle compatibility
+        compat_angle = np.abs(np.sum(vec_p * vec_q, axis=-1)) / (norm_p * norm_q + 1e-8)
 
         # Length compatibility
-        l_avg = (vec_norm + np.transpose(vec_norm)) / 2
-        compat_length = []
-
-        for i in range(len(vec_norm)):
-            row = []
-            for j in range(len(vec_norm)):
-                min_val = min(vec_norm[i], vec_norm[j])
-                max_val = max(vec_norm[i], vec_norm[j])
-                avg_val = l_avg[i][j]
-                comp_length = (2 / ((avg_val / (min_val + 1e-8)) + (max_val / (avg_val + 1e-8)) + 1e-8))[0]
-                row.append(comp_length)
-            compat_length.append(row)
-
-        compat_length = np.array(compat_length)
+        l_avg = (norm_p + norm_q) / 2
+        l_min = np.minimum(norm_p, norm_q)
+        l_max = np.maximum(norm_p, norm_q)
+        compat_length = 2 / ((l_avg / (l_min + 1e-8)) + (l_max / (l_avg + 1e-8)) + 1e-8)
 
         # Distance compatibility
-        midpoint = (edges[:, 0] + edges[:, -1]) / 2
-        midpoint_dist = np.linalg.norm(midpoint[None, :] - midpoint[:, None], axis=-1)
+        mid_p = (src_p + dst_p) / 2
+        mid_q = (src_q + dst_q) / 2
+        midpoint_dist = np.linalg.norm(mid_p - mid_q, axis=-1)
         compat_dist = l_avg / (l_avg + midpoint_dist + 1e-8)
 
-        # Visibility compatibility
-        ap = edges[None, ...] - edges[:, None, None, 0]
-
-        # Calculate t
-        t = []
-        for i in range(len(vec)):
-            t_i = []
-            for j in range(len(edges)):
-                t_ij = []
-                for k in range(len(edges[0])):
-                    numerator = sum(ap[i][j][k][l] * vec[i][l] for l in range(len(vec[0])))
-                    denominator = sum(vec[i][l] ** 2 for l in range(len(vec[0]))) + 1e-8
-                    t_ij.append(numerator / denominator)
-                t_i.append(t_ij)
-            t.append(t_i)
-        t = np.array(t)
-
-        # Calculate I
-        I = []
-        for i in range(len(edges)):
-            I_i = []
-            for j in range(len(edges)):
-                I_ij = []
-                for k in range(len(t[i][j])):
-                    I_ijk = []
-                    for l in range(len(vec[0])):
-                        I_ijk.append(edges[i][0][l] + t[i][j][k] * vec[i][l])
-                    I_ij.append(I_ijk)
-                I_i.append(I_ij)
-            I.append(I_i)
-        I = np.array(I)
-
-        # Extract i0 and i1 from I
-        i0 = []
-        i1 = []
-
-        for i in range(len(I)):
-            i0_i = []
-            i1_i = []
-            for j in range(len(I[i])):
-                i0_i.append(I[i][j][0])
-                i1_i.append(I[i][j][1])
-            i0.append(i0_i)
-            i1.append(i1_i)
-
-        i0 = np.array(i0)
-        i1 = np.array(i1)
-
-        # Calculate the midpoint Im
-        Im = []
-        for i in range(len(i0)):
-            Im_i = []
-            for j in range(len(i0[i])):
-                Im_ij = [(i0[i][j][k] + i1[i][j][k]) / 2 for k in range(len(i0[i][j]))]
-                Im_i.append(Im_ij)
-            Im.append(Im_i)
-
-        Im = np.array(Im)
-
-        denom = np.sqrt(np.sum((i0 - i1) ** 2, axis=-1))
-        num = 2 * np.linalg.norm(midpoint[:, None, ...] - Im, axis=-1)
-        compat_visibility = np.maximum(0, 1 - num / (denom + 1e-8))
-        compat_visibility = np.minimum(compat_visibility, compat_visibility.T)
-        compatibility_matrix = compat_angle * compat_length * compat_dist * compat_visibility
-        compatibility_matrix = np.where(compatibility_matrix > self.compat_threshold, 1, 0)
+        # Visibility compatibility, symmetrised by taking the smaller of both directions
+        compat_visibility = np.minimum(
+            Fdeb._visibility(src_p, vec_p, mid_p, src_q, dst_q),
+            Fdeb._visibility(src_q, vec_q, mid_q, src_p, dst_p)
+        )
 
-        return compatibility_matrix
+        return compat_angle * compat_length * compat_dist * compat_visibility
+
+    @staticmethod
+    def _visibility(src_p: np.ndarray, vec_p: np.ndarray, mid_p: np.ndarray, src_q: np.ndarray,
+                    dst_q: np.ndarray) -> np.ndarray:
+        # Project the endpoints of q onto the line through p
+        sq_norm_p = np.sum(vec_p ** 2, axis=-1, keepdims=True) + 1e-8
+        i0 = src_p + np.sum((src_q - src_p) * vec_p, axis=-1, keepdims=True) / sq_norm_p * vec_p
+        i1 = src_p + np.sum((dst_q - src_p) * vec_p, axis=-1, keepdims=True) / sq_norm_p * vec_p
+        im = (i0 + i1) / 2
+
+        denom = np.linalg.norm(i0 - i1, axis=-1)
+        num = 2 * np.linalg.norm(mid_p - im, axis=-1)
+        return np.maximum(0, 1 - num / (denom + 1e-8))
 
     def my_fdeb(self, edges):
+        monitored = self.monitored()
+        run_start = time.perf_counter()
+        self.snapshots = []
+        self.iterations = 0
+        self.iterations_saved = 0
+
+        center, scale = self.frame(edges)
+        edges = ((edges - center) / scale).astype(self.dtype)
+
         initial_vecs = edges[:, 0] - edges[:, -1]
         initial_edge_lengths = np.linalg.norm(initial_vecs, axis=-1, keepdims=True)
-        edge_compatibilities = self.get_edge_compatibility(edges)
+        compat_start = time.perf_counter()
+        if self.sparse_compat:
+            edge_compatibilities = self.get_sparse_edge_compatibility(edges)
+        else:
+            edge_compatibilities = self.get_edge_compatibility(edges)
+
+        if monitored:
+            self.emit({'event': 'start', 'n_edges': len(edges), 'active_pairs': self.active_pairs(edge_compatibilities),
+                       'compatibility_seconds': time.perf_counter() - compat_start})
+
+        for cycle, (num_points, segments, n_iter_val, lr_val) in enumerate(tqdm(self.schedule(), total=self.n_cycles)):
+            cycle_start = time.perf_counter()
+            edges = self.subdivide_edges(edges, num_points).astype(self.dtype, copy=False)
+            subdivide_seconds = time.perf_counter() - cycle_start
+
+            kp_values = self.K / (initial_edge_lengths * segments + 1e-8)
+            edges = self.relax(edges, edge_compatibilities, kp_values[..., None].astype(self.dtype), n_iter_val,
+                               lr_val, cycle)
+
+            if monitored:
+                self.emit({'event': 'cycle', 'cycle': cycle, 'num_points': num_points, 'n_iter': n_iter_val,
+                           'lr': lr_val, 'subdivide_seconds': subdivide_seconds,
+                           'relax_seconds': time.perf_counter() - cycle_start - subdivide_seconds,
+                           'edges': edges * scale + center})
+
+        self.workspace = None
+        self.edge_compatibilities = edge_compatibilities
+
+        if monitored:
+            self.emit({'event': 'end', 'iterations': self.iterations, 'iterations_saved': self.iterations_saved,
+                       'seconds': time.perf_counter() - run_start})
+
+        return edges * scale + center
+
+    # Forces only depend on coordinate differences, so the layout is centred before bundling, which keeps float32
+    # precise, and scaled down, which keeps the cubic spring term from blowing up. The scale is coord_scale or the
+    # one that maps the larger side of the layout to FRAME_EXTENT. Sets and returns center and scale.
+    def frame(self, edges: np.ndarray) -> tuple:
+        self.center = (edges.min(axis=(0, 1)) + edges.max(axis=(0, 1))) / 2
+        if self.coord_scale is not None:
+            self.scale = self.coord_scale
+        else:
+            extent = max(float(np.ptp(edges[..., 0])), float(np.ptp(edges[..., 1]))) if edges.size else 0.0
+            self.scale = extent / FRAME_EXTENT if extent > 0 else 1.0
+        return self.center, self.scale
+
+    # Number of distinct compatible pairs (p, q) with p != q
+    def active_pairs(self, edge_compatibilities: np.ndarray) -> int:
+        if self.sparse_compat:
+            return len(edge_compatibilities)
+        return int(np.count_nonzero(edge_compatibilities) - np.count_nonzero(np.diagonal(edge_compatibilities))) // 2
+
+    # Number of subdivision points, spring segment count, iterations and step size of every cycle
+    def schedule(self) -> list:
+        cycles = []
         segments = self.initial_segpoints
         lr_val = self.lr
         n_iter_val = self.n_iter
 
-        for _ in tqdm(range(self.n_cycles)):
-            edges = self.subdivide_edges(edges, segments + 2)
+        for _ in range(self.n_cycles):
+            num_points = segments + 2
             segments = int(np.ceil(segments * self.segpoint_increase))
+            cycles.append((num_points, segments, n_iter_val, lr_val))
 
-            kp_values = self.K / (initial_edge_lengths * segments + 1e-8)
-            kp_values = kp_values[..., None]
+            n_iter_val = int(np.ceil(self.n_iter * self.n_iter_reduction))
+            lr_val = lr_val * self.lr_reduction
 
-            for epoch in range(n_iter_val):
+        return cycles
+
+    # Runs n_iter force iterations on the subdivided edges in place. When monitored, every iteration reports
+    # its force time, the mean and max displacement of the subdivision points in input coordinates and the force
+    # residual, half the sum of squared forces, which goes to 0 at equilibrium. It is not the bundling energy, whose
+    # gradient the forces are. Every snapshot_every-th iteration stores a copy of the edges.
+    def relax(self, edges: np.ndarray, edge_compatibilities: np.ndarray, kp_values: np.ndarray, n_iter: int,
+              lr: float, cycle: int = 0) -> np.ndarray:
+        self.workspace = FdebWorkspace(edges.shape, self.dtype)
+        monitored = self.monitored()
+        if monitored:
+            active_pairs = self.active_pairs(edge_compatibilities)
+        if self.adaptive:
+            last_step = np.zeros_like(edges)
+        if self.adaptive and self.step_adaptation:
+            steps = np.ones((edges.shape[0], 1, 1), dtype=self.dtype)
+            last_forces = np.empty_like(edges)
+
+        for epoch in range(n_iter):
+            if monitored:
+                start = time.perf_counter()
+
+            if self.sparse_compat:
+                forces = self.compute_forces_sparse(edges, edge_compatibilities, kp_values)
+            else:
                 forces = self.compute_forces(edges, edge_compatibilities, kp_values)
-                edges += forces * lr_val
 
-            n_iter_val = int(np.ceil(self.n_iter * self.n_iter_reduction))
-            lr_val = lr_val * self.lr_reduction
+            if monitored:
+                forces_seconds = time.perf_counter() - start
+
+            if self.adaptive and self.step_adaptation:
+                rejected = self.adapt_steps(edges, forces, steps, last_step, last_forces)
+                np.copyto(last_forces, forces)
+
+            if monitored:
+                force_residual = 0.5 * float(np.einsum('ijk,ijk->', forces, forces))
+
+            if self.adaptive and self.step_adaptation:
+                forces *= steps
+            forces *= lr
+            edges += forces
+            self.iterations += 1
+
+            if monitored:
+                displacements = self.scale * np.linalg.norm(forces, axis=-1)
+                event = {'event': 'iteration', 'cycle': cycle, 'iteration': epoch, 'forces_seconds': forces_seconds,
+                         'mean_displacement': float(displacements.mean()),
+                         'max_displacement': float(displacements.max()), 'force_residual': force_residual,
+                         'active_pairs': active_pairs}
+                if self.adaptive and self.step_adaptation:
+                    event['rejected_steps'] = rejected
+                if self.snapshot_every > 0 and self.iterations % self.snapshot_every == 0:
+                    event['edges'] = edges * self.scale + self.center
+                    event['snapshot'] = len(self.snapshots)
+                    self.snapshots.append(event['edges'])
+                self.emit(event)
+
+            if self.adaptive:
+                # The net move over the last two iterations, a point swinging back and forth has not converged
+                # but barely gets anywhere
+                converged = epoch + 1 >= self.min_iter and self.displacement(forces + last_step) < self.tolerance
+                np.copyto(last_step, forces)
+                if converged:
+                    self.iterations_saved += n_iter - epoch - 1
+                    break
 
         return edges
 
-    def subdivide_edges(self, edges: np.ndarray, num_points: int) -> np.ndarray:
-        segment_vecs = [[edges[i][j + 1] - edges[i][j] for j in range(len(edges[i]) - 1)] for i in range(len(edges))]
-        segment_lens = [[math.sqrt(sum((x_k ** 2 for x_k in segment_vecs[i][j]))) for j in range(len(segment_vecs[i]))]
-                        for i in range(len(segment_vecs))]
-        cum_segment_lens = np.array([[0] + [sum(segment_lens[i][:j + 1]) for j in range(len(segment_lens[i]))] for i in
-                            range(len(segment_lens))])
+    # Per-edge step control of the adaptive mode. The energy changes along a step by minus the force times the step,
+    # so an edge whose new force points against its last step has moved past the energy minimum along it. Its step
+    # is rejected: the edge moves back, takes its previous forces again and halves its step size. All other edges
+    # grow their step size up to the scheduled one. Works in place and returns the number of rejected steps.
+    def adapt_steps(self, edges: np.ndarray, forces: np.ndarray, steps: np.ndarray, last_step: np.ndarray,
+                    last_forces: np.ndarray) -> int:
+        rejected = np.einsum('ijk,ijk->i', forces, last_step) < 0
+        edges[rejected] -= last_step[rejected]
+        last_step[rejected] = 0
+        forces[rejected] = last_forces[rejected]
+        steps[rejected] *= self.step_decrease
+        steps[~rejected] = np.minimum(steps[~rejected] * self.step_increase, 1)
+        return int(np.count_nonzero(rejected))
+
+    # Rms or max displacement of the subdivision points in bundling coordinates, step being the last update. As the
+    # frame maps every layout to the same extent, one tolerance suits layouts of any size.
+    def displacement(self, step: np.ndarray) -> float:
+        squared = np.einsum('ijk,ijk->ij', step, step)
+        return self.displacement_norm(float(squared.sum()), float(squared.max()), squared.size)
+
+    # The same from the sum and the maximum of the squared steps of n_points points, for steps reduced block by block
+    def displacement_norm(self, squared_sum: float, squared_max: float, n_points: int) -> float:
+        if self.tolerance_norm == 'rms':
+            return math.sqrt(squared_sum / n_points)
+        if self.tolerance_norm == 'max':
+            return math.sqrt(squared_max)
+        raise ValueError(f"Unknown tolerance norm {self.tolerance_norm}, expected 'rms' or 'max'")
+
+    # Updates a previous bundling after routes were added or removed. edges and bundled are the straight input
+    # edges and the my_fdeb result of the previous run and pairs its sparse compatibility (edge_compatibilities
+    # after my_fdeb). Only the compatibility rows of the added edges are scored, the kept edges start from their
+    # bundled positions and everything is relaxed for incremental_iter iterations at the final cycle's step size.
+    # Returns the new straight edges, bundled edges and pairs, ordered as the kept edges followed by the added ones.
+    def my_fdeb_incremental(self, edges: np.ndarray, bundled: np.ndarray, pairs: np.ndarray, added: np.ndarray = None,
+                            removed: np.ndarray = None) -> tuple:
+        pairs = np.asarray(pairs)
+        if pairs.ndim != 2 or pairs.shape[1] != 2:
+            raise ValueError(f'pairs must be the (N x 2) compatible pairs of a sparse_compat run, '
+                             f'got shape {pairs.shape}')
+        added = np.zeros((0, 2, 2)) if added is None else np.asarray(added, dtype=np.float64)
+        keep = np.ones(len(edges), dtype=bool)
+        if removed is not None:
+            keep[np.asarray(removed, dtype=np.int64)] = False
+
+        # Drop the pairs of removed edges and renumber the rest
+        new_index = np.cumsum(keep) - 1
+        pairs = pairs[keep[pairs[:, 0]] & keep[pairs[:, 1]]]
+        pairs = new_index[pairs]
+
+        straight = np.concatenate([edges[keep][:, [0, -1]], added[:, [0, -1]]], axis=0)
+        n_kept = int(keep.sum())
+
+        # Score the added edges against all edges, each pair once from its higher index
+        src, dst = straight[:, 0], straight[:, -1]
+        new_pairs = [pairs.astype(np.int64)]
+        for start in range(n_kept, len(straight), self.compat_block_size):
+            stop = min(start + self.compat_block_size, len(straight))
+            scores = self.pair_compatibility(src[start:stop, None], dst[start:stop, None], src[None, :stop],
+                                             dst[None, :stop])
+            rows, cols = np.nonzero(np.tril(scores > self.compat_threshold, k=start - 1))
+            new_pairs.append(np.stack([cols, rows + start], axis=-1))
+
+        keys = np.sort(np.concatenate([p[:, 0] * len(straight) + p[:, 1] for p in new_pairs]))
+        pairs = np.stack([keys // len(straight), keys % len(straight)], axis=-1).astype(np.int32)
+
+        # Warm start: kept edges continue from their bundled polylines, added ones start straight
+        center, scale = self.frame(straight)
+        num_points, segments, _, lr_val = self.schedule()[-1]
+        warm = np.concatenate([bundled[keep], self.subdivide_edges(added, bundled.shape[1]) if len(added) else
+                               np.zeros((0,) + bundled.shape[1:])], axis=0)
+        warm = ((warm - center) / scale).astype(self.dtype)
+
+        initial_edge_lengths = np.linalg.norm(straight[:, 0] - straight[:, -1], axis=-1, keepdims=True)
+        kp_values = self.K / (initial_edge_lengths / scale * segments + 1e-8)
+        sparse_compat, self.sparse_compat = self.sparse_compat, True
+        self.snapshots = []
+        self.iterations = 0
+        self.iterations_saved = 0
+        try:
+            warm = self.relax(warm, pairs, kp_values[..., None].astype(self.dtype), self.incremental_iter, lr_val,
+                              self.n_cycles - 1)
+        finally:
+            self.sparse_compat = sparse_compat
+            self.workspace = None
+
+        self.edge_compatibilities = pairs
+        return straight, warm * scale + center, pairs
+
+    # Returns the workspace for edges of this shape, allocating a new one only when the shape changes
+    def _workspace(self, e: np.ndarray) -> "FdebWorkspace":
+        if self.workspace is None or self.workspace.shape != e.shape or self.workspace.dtype != e.dtype:
+            self.workspace = FdebWorkspace(e.shape, e.dtype)
+        return self.workspace
+
+    # Forces on all edges from the dense compatibility matrix. Like compute_forces_sparse and compute_forces_range
+    # without out, it returns the workspace force buffer, which the next call overwrites, so copy it to keep it.
+    def compute_forces(self, e: np.ndarray, e_compat: np.ndarray, kp: np.ndarray) -> np.ndarray:
+        ws = self._workspace(e)
+        F = self.compute_spring_forces(e, kp)
+
+        # Calculate electrostatic forces, accumulated over tiles of source edges so that the
+        # (tile x E x P x 2) temporaries stay within max_bytes
+        n_edges, n_points = e.shape[0], e.shape[1]
+        tile = self._tile_size(3 * n_edges * n_points * e.itemsize, n_edges)
+        v_electro, distances = ws.buffer('v_electro', (tile,) + e.shape), ws.buffer('distances', (tile,) + e.shape[:2])
+        F_electro = ws.buffer('f_tile', e.shape)
+
+        for start in range(0, n_edges, tile):
+            n = min(tile, n_edges - start)
+            v, d = v_electro[:n], distances[:n]
+            np.subtract(e[start:start + n, np.newaxis, :, :], e[np.newaxis, :, :, :], out=v)
+            np.einsum('ijkl,ijkl->ijk', v, v, out=d)
+            np.sqrt(d, out=d)
+            d += 1e-8
+            np.divide(e_compat[start:start + n, :, np.newaxis], d, out=d)
+            v *= d[..., np.newaxis]
+            np.sum(v, axis=0, out=F_electro)
+            F += F_electro
 
-        total_lens = cum_segment_lens[:, -1]
-        t = np.linspace(0, 1, num=num_points, endpoint=True)
-        desired_lens = t * total_lens[:, None]
-        i = np.argmax(desired_lens[:, None] < cum_segment_lens[..., None], axis=1)
-        pct = (desired_lens - np.take_along_axis(np.array(cum_segment_lens), i - 1, axis=-1)) / (
-                np.take_along_axis(np.array(segment_lens), i - 1, axis=-1) + 1e-8
-        )
+        F[:, 0, :] = F[:, -1, :] = 0
 
-        row_indices = np.arange(edges.shape[0])[:, None]
-        new_points = (
-                (1 - pct[..., None]) * edges[row_indices, i - 1]
-                + pct[..., None] * edges[row_indices, i]
-        )
+        return F
 
-        return new_points
+    # Electrostatic forces are evaluated only over the compatible pairs returned by get_sparse_edge_compatibility.
+    # Each pair is visited once and applies equal and opposite forces to both of its edges. Returns the workspace
+    # force buffer, which the next call overwrites.
+    def compute_forces_sparse(self, e: np.ndarray, e_pairs: np.ndarray, kp: np.ndarray) -> np.ndarray:
+        ws = self._workspace(e)
+        F = self.compute_spring_forces(e, kp)
+        F_flat = F.reshape(e.shape[0], -1)
+        chunk = min(self._tile_size(3 * e.shape[1] * e.itemsize, self.pair_chunk_size), max(1, e_pairs.shape[0]))
+        v_electro = ws.buffer('v_electro', (chunk,) + e.shape[1:])
+        v_other = ws.buffer('v_other', (chunk,) + e.shape[1:])
+        distances = ws.buffer('distances', (chunk, e.shape[1]))
+
+        for start in range(0, e_pairs.shape[0], chunk):
+            p, q = e_pairs[start:start + chunk].T
+            n = len(p)
+            v, d = v_electro[:n], distances[:n]
+            np.take(e, p, axis=0, out=v)
+            np.take(e, q, axis=0, out=v_other[:n])
+            v -= v_other[:n]
+            np.einsum('ijk,ijk->ij', v, v, out=d)
+            np.sqrt(d, out=d)
+            d += 1e-8
+            v /= d[..., np.newaxis]
+            v_flat = v.reshape(n, -1)
+
+            # Edge q is pulled towards p and p towards q
+            np.add.at(F_flat, q, v_flat)
+            np.subtract.at(F_flat, p, v_flat)
 
-    def compute_forces(self, e: np.ndarray, e_compat: np.ndarray, kp: np.ndarray) -> np.ndarray:
-        # Compute left-mid and right-mid spring velocities
-        v_spring_l = np.array([[e[i][j] - e[i][j + 1] for j in range(len(e[i]) - 1)] for i in range(len(e))])
-        v_spring_r = np.array([[e[i][j + 1] - e[i][j] for j in range(len(e[i]) - 1)] for i in range(len(e))])
-        v_spring_l_new = np.zeros((v_spring_l.shape[0], v_spring_l.shape[1]+1, v_spring_l.shape[-1]))
-        v_spring_r_new = np.zeros((v_spring_r.shape[0], v_spring_r.shape[1]+1, v_spring_r.shape[-1]))
-
-        for i in range(v_spring_l.shape[0]):
-            sub_arr_l = np.zeros((v_spring_l.shape[1]+1, v_spring_l.shape[-1]))
-            sub_arr_l[1:, :] = v_spring_l[i, :, :]
-            v_spring_l_new[i, :, :] = sub_arr_l
-
-            sub_arr_r = np.zeros((v_spring_r.shape[1]+1, v_spring_r.shape[-1]))
-            sub_arr_r[:-1, :] = v_spring_r[i, :, :]
-            v_spring_r_new[i, :, :] = sub_arr_r
-
-        f_spring_l = np.sum(v_spring_l_new ** 2, axis=-1, keepdims=True)
-        f_spring_r = np.sum(v_spring_r_new ** 2, axis=-1, keepdims=True)
-        F_spring = kp * (f_spring_l * v_spring_l_new + f_spring_r * v_spring_r_new)
-
-        # Calculate electrostatic forces
-        v_electro = e[:, np.newaxis, :, :] - e[np.newaxis, :, :, :]
-        distances = np.linalg.norm(v_electro, axis=-1) + 1e-8
-        f_electro = e_compat[:, :, np.newaxis] / distances
-        F_electro = np.sum(f_electro[:, :, :, np.newaxis] * v_electro, axis=0)
-        F = F_spring + F_electro
+        F[:, 0, :] = F[:, -1, :] = 0
+
+        return F
+
+    # Symmetric CSR neighbour lists of the compatible pairs (i, j), i < j: the neighbours of edge i are
+    # indices[indptr[i]:indptr[i + 1]]. Pairs are read in chunks and their neighbours written at a running cursor
+    # per edge, so both pairs and indices may be memory-mapped. indices is allocated unless it is given.
+    def neighbor_lists(self, n_edges: int, pairs: np.ndarray, indices: np.ndarray = None) -> tuple:
+        chunk = self.pair_chunk_size * 16
+        indptr = np.zeros(n_edges + 1, dtype=np.int64)
+        for start in range(0, len(pairs), chunk):
+            indptr[1:] += np.bincount(np.asarray(pairs[start:start + chunk]).ravel(), minlength=n_edges)
+        np.cumsum(indptr, out=indptr)
+
+        if indices is None:
+            indices = np.empty(indptr[-1], dtype=np.int32)
+        cursor = indptr[:-1].copy()
+        for start in range(0, len(pairs), chunk):
+            p, q = np.asarray(pairs[start:start + chunk]).T
+            for rows, cols in ((p, q), (q, p)):
+                order = np.argsort(rows, kind='stable')
+                rows, cols = rows[order], cols[order]
+                counts = np.bincount(rows, minlength=n_edges)
+                ranks = np.arange(len(rows)) - np.repeat(np.cumsum(counts) - counts, counts)
+                indices[cursor[rows] + ranks] = cols
+                cursor += counts
+
+        return indptr, indices
+
+    # Spring and electrostatic forces on the edges [lo, hi) from their neighbour lists, written into out or the
+    # workspace force buffer. Unlike compute_forces_sparse every pair is visited from both of its edges, so ranges
+    # of edges can be processed independently, by parallel workers or block by block out of core. e and indices
+    # may be memory-mapped, neighbours are gathered in chunks of pair_chunk_size.
+    def compute_forces_range(self, e: np.ndarray, indptr: np.ndarray, indices: np.ndarray, kp: np.ndarray, lo: int,
+                             hi: int, out: np.ndarray = None) -> np.ndarray:
+        block = np.asarray(e[lo:hi])
+        F = self.compute_spring_forces(block, kp[lo:hi], out=out)
+        F_flat = F.reshape(hi - lo, -1)
+        chunk = self._tile_size(8 * e.shape[1] * e.itemsize, self.pair_chunk_size)
+
+        for start in range(indptr[lo], indptr[hi], chunk):
+            stop = min(start + chunk, indptr[hi])
+            targets = np.searchsorted(indptr, np.arange(start, stop), side='right') - 1
+            v_electro = e[np.asarray(indices[start:stop])] - block[targets - lo]
+            v_electro /= np.linalg.norm(v_electro, axis=-1, keepdims=True) + 1e-8
+
+            # Neighbour lists are sorted by target, so the contributions of every target are summed as one run
+            first = np.flatnonzero(np.diff(targets, prepend=-1))
+            F_flat[targets[first] - lo] += np.add.reduceat(v_electro.reshape(stop - start, -1), first, axis=0)
 
         F[:, 0, :] = F[:, -1, :] = 0
+        return F
+
+    # Number of items per tile such that the temporaries of one tile fit into max_bytes. A tile holds at least one
+    # item, so a budget below bytes_per_item is exceeded by the temporaries of that item rather than failing.
+    def _tile_size(self, bytes_per_item: int, default: int) -> int:
+        if self.max_bytes is None:
+            return max(1, default)
+        return max(1, min(default, int(self.max_bytes // bytes_per_item)))
+
+    # Each subdivision point is pulled towards both of its neighbours with kp * |d|^2 * d, where d is the
+    # vector to the neighbour. The result is written into out, or into the workspace force buffer.
+    def compute_spring_forces(self, e: np.ndarray, kp: np.ndarray, out: np.ndarray = None) -> np.ndarray:
+        ws = self._workspace(e)
+        F = ws.forces if out is None else out
+        segments = ws.buffer('segments', (e.shape[0], e.shape[1] - 1, e.shape[2]))
+        segment_sq = ws.buffer('segment_sq', (e.shape[0], e.shape[1] - 1))
+
+        np.subtract(e[:, 1:], e[:, :-1], out=segments)
+        np.einsum('ijk,ijk->ij', segments, segments, out=segment_sq)
+        segments *= segment_sq[..., np.newaxis]
+
+        F[:, -1] = 0
+        F[:, :-1] = segments
+        F[:, 1:] -= segments
+        F *= kp
 
         return F
+
+
+# Preallocated buffers for one subdivision cycle of Fdeb.my_fdeb, so that the iterations of a cycle do not
+# allocate any arrays of edge size
+class FdebWorkspace:
+    def __init__(self, shape: tuple, dtype=np.float64):
+        self.shape = tuple(shape)
+        self.dtype = np.dtype(dtype)
+        self.forces = np.zeros(self.shape, dtype=self.dtype)
+        self.buffers = {}
+
+    # Named scratch buffer of the given shape, reallocated only if it is too small
+    def buffer(self, name: str, shape: tuple) -> np.ndarray:
+        size = int(np.prod(shape))
+        if name not in self.buffers or self.buffers[name].size < size:
+            self.buffers[name] = np.empty(size, dtype=self.dtype)
+        return self.buffers[name][:size].reshape(shape)
+
+
+# Callback for Fdeb.callbacks that writes every event as one JSON line. Edge arrays are left out, snapshot events
+# keep their snapshot index.
+class FdebLog:
+    def __init__(self, path: str):
+        self.path = path
+        self.file = open(path, 'w')
+
+    def __call__(self, event: dict):
+        self.file.write(json.dumps({key: value for key, value in event.items() if key != 'edges'}) + '\n')
+
+    def close(self):
+        self.file.close()
@@ -0,0 +1,267 @@
+import json
+import os
+import time
+
+import numpy as np
+from tqdm import tqdm
+
+from bundle_cache import bundle_key
+from fdeb import Fdeb
+
+
+# Out-of-core FDEB for graphs whose subdivided edges do not fit into memory next to the force buffers. Edge
+# positions, the compatible pairs and their symmetric neighbour lists live in .npy files memory-mapped from
+# directory, and every force iteration streams through the edges in blocks of block_size, reading the current
+# positions from one file and writing the updated ones to another. Only per-edge scalars and the straight edges
+# stay in memory. After the compatibility and after every cycle the state is checkpointed, so a run that was
+# interrupted resumes from its last completed cycle when it is started again with the same input and
+# hyperparameters. Relaxation is the same Jacobi update as Fdeb.relax, adaptive runs stop early but keep the
+# scheduled step size, since per-edge step adaptation needs the previous step of every point.
+class OutOfCoreFdeb(Fdeb):
+    def __init__(self, directory: str):
+        super(OutOfCoreFdeb, self).__init__()
+        self.directory = directory
+        self.block_size = 16384  # edges per force block
+        self.resume = True
+        self.sparse_compat = True
+        self.step_adaptation = False
+
+    def path(self, name: str) -> str:
+        return os.path.join(self.directory, name)
+
+    def my_fdeb(self, edges):
+        if self.adaptive and self.step_adaptation:
+            raise ValueError('Per-edge step adaptation is not supported out of core, disable step_adaptation')
+
+        monitored = self.monitored()
+        run_start = time.perf_counter()
+        os.makedirs(self.directory, exist_ok=True)
+        self.snapshots = []
+
+        key = bundle_key(self, np.asarray(edges)[:, [0, -1]])
+        state = self.load_state(key) if self.resume else None
+        if state is None:
+            state = {'key': key, 'cycle': -1, 'iterations': 0, 'iterations_saved': 0}
+        self.iterations = state['iterations']
+        self.iterations_saved = state['iterations_saved']
+
+        # Same coordinate frame as Fdeb.my_fdeb, the straight edges are small enough to stay in memory
+        center, scale = self.frame(np.asarray(edges)[:, [0, -1]])
+        straight = ((np.asarray(edges)[:, [0, -1]] - center) / scale).astype(self.dtype)
+        initial_edge_lengths = np.linalg.norm(straight[:, 0] - straight[:, -1], axis=-1, keepdims=True)
+
+        # The pairs and neighbour lists are kept from a run that got past the compatibility
+        compat_start = time.perf_counter()
+        if 'n_pairs' not in state or not os.path.exists(self.path('indices.npy')):
+            self.clear()
+            n_pairs = self.write_pairs(straight)
+            self.write_neighbors(len(straight), n_pairs)
+            state = {**state, 'cycle': -1, 'n_pairs': n_pairs}
+            self.save_state(state)
+        self.edge_compatibilities = np.memmap(self.path('pairs.int32'), dtype=np.int32, mode='r').reshape(-1, 2) \
+            if state['n_pairs'] else np.zeros((0, 2), dtype=np.int32)
+
+        if monitored:
+            self.emit({'event': 'start', 'n_edges': len(straight), 'active_pairs': state['n_pairs'],
+                       'compatibility_seconds': time.perf_counter() - compat_start, 'resumed_cycle': state['cycle']})
+
+        schedule = self.schedule()
+        for cycle in tqdm(range(state['cycle'] + 1, self.n_cycles), total=self.n_cycles, initial=state['cycle'] + 1):
+            num_points, segments, n_iter_val, lr_val = schedule[cycle]
+            cycle_start = time.perf_counter()
+            previous = np.load(self.path(f'cycle_{cycle - 1}.npy'), mmap_mode='r') if cycle > 0 else straight
+            current = np.lib.format.open_memmap(self.path('relax_a.npy'), mode='w+', dtype=self.dtype,
+                                                shape=(len(straight), num_points, 2))
+            for lo in range(0, len(straight), self.block_size):
+                current[lo:lo + self.block_size] = self.subdivide_edges(previous[lo:lo + self.block_size], num_points)
+            del previous
+            subdivide_seconds = time.perf_counter() - cycle_start
+
+            kp_values = (self.K / (initial_edge_lengths * segments + 1e-8))[..., None].astype(self.dtype)
+            result = self.relax_out_of_core(current, kp_values, n_iter_val, lr_val, cycle)
+
+            # The new checkpoint is complete before the state points to it, the previous one is removed last
+            os.replace(result, self.path(f'cycle_{cycle}.npy'))
+            state = {**state, 'cycle': cycle, 'iterations': self.iterations, 'iterations_saved': self.iterations_saved}
+            self.save_state(state)
+            for name in (f'cycle_{cycle - 1}.npy', 'relax_a.npy', 'relax_b.npy'):
+                if os.path.exists(self.path(name)):
+                    os.remove(self.path(name))
+
+            if monitored:
+                self.emit({'event': 'cycle', 'cycle': cycle, 'num_points': num_points, 'n_iter': n_iter_val,
+                           'lr': lr_val, 'subdivide_seconds': subdivide_seconds,
+                           'relax_seconds': time.perf_counter() - cycle_start - subdivide_seconds,
+                           'checkpoint': self.path(f'cycle_{cycle}.npy')})
+
+        # Back to input coordinates, again block by block
+        final = np.load(self.path(f'cycle_{self.n_cycles - 1}.npy'), mmap_mode='r')
+        bundled = np.lib.format.open_memmap(self.path('bundled.npy'), mode='w+', dtype=np.float64, shape=final.shape)
+        for lo in range(0, len(final), self.block_size):
+            bundled[lo:lo + self.block_size] = final[lo:lo + self.block_size] * scale + center
+        bundled.flush()
+        del bundled, final
+        self.workspace = None
+
+        if monitored:
+            self.emit({'event': 'end', 'iterations': self.iterations, 'iterations_saved': self.iterations_saved,
+                       'seconds': time.perf_counter() - run_start})
+
+        return np.load(self.path('bundled.npy'), mmap_mode='r')
+
+    # Runs n_iter force iterations, alternating between relax_a.npy and relax_b.npy as the current and the updated
+    # positions. Returns the path of the file holding the final positions.
+    def relax_out_of_core(self, current: np.ndarray, kp_values: np.ndarray, n_iter: int, lr: float,
+                          cycle: int = 0) -> str:
+        monitored = self.monitored()
+        indptr = np.load(self.path('indptr.npy'))
+        indices = np.load(self.path('indices.npy'), mmap_mode='r')
+        names = ['relax_a.npy', 'relax_b.npy']
+        updated = np.lib.format.open_memmap(self.path(names[1]), mode='w+', dtype=self.dtype, shape=current.shape)
+        n_points = current.shape[0] * current.shape[1]
+
+        for epoch in range(n_iter):
+            forces_seconds = squared_max = length_sum = force_residual = net_sum = net_max = 0.0
+
+            for lo in range(0, len(current), self.block_size):
+                hi = min(lo + self.block_size, len(current))
+                block_start = time.perf_counter()
+                forces = self.compute_forces_range(current, indptr, indices, kp_values, lo, hi)
+                forces_seconds += time.perf_counter() - block_start
+
+                if monitored:
+                    force_residual += 0.5 * float(np.einsum('ijk,ijk->', forces, forces))
+                forces *= lr
+
+                # updated still holds the positions of two iterations ago, so the net move of the last two iterations
+                # is taken before they are overwritten. Only its reductions are kept, as displacement_norm takes them.
+                if self.adaptive:
+                    net = forces + current[lo:hi] - updated[lo:hi] if epoch > 0 else forces
+                    squared = np.einsum('ijk,ijk->ij', net, net)
+                    net_sum += float(squared.sum())
+                    net_max = max(net_max, float(squared.max()))
+                np.add(current[lo:hi], forces, out=updated[lo:hi])
+
+                if monitored:
+                    squared = np.einsum('ijk,ijk->ij', forces, forces)
+                    squared_max = max(squared_max, float(squared.max()))
+                    length_sum += float(np.sqrt(squared).sum())
+
+            current, updated = updated, current
+            names.reverse()
+            self.iterations += 1
+
+            if monitored:
+                self.emit({'event': 'iteration', 'cycle': cycle, 'iteration': epoch, 'forces_seconds': forces_seconds,
+                           'mean_displacement': self.scale * length_sum / n_points,
+                           'max_displacement': self.scale * float(np.sqrt(squared_max)),
+                           'force_residual': force_residual,
+                           'active_pairs': int(indptr[-1]) // 2})
+
+            if self.adaptive and epoch + 1 >= self.min_iter and \
+                    self.displacement_norm(net_sum, net_max, n_points) < self.tolerance:
+                self.iterations_saved += n_iter - epoch - 1
+                break
+
+        current.flush()
+        del current, updated
+        return self.path(names[0])
+
+    # Scores the compatible pairs compat_block_size edges at a time, like get_sparse_edge_compatibility, and appends
+    # them to pairs.int32. Returns their number.
+    def write_pairs(self, straight: np.ndarray) -> int:
+        n_pairs = 0
+        src, dst = straight[:, 0], straight[:, -1]
+        with open(self.path('pairs.int32'), 'wb') as f:
+            for lo in range(0, len(straight), self.compat_block_size):
+                hi = min(lo + self.compat_block_size, len(straight))
+                if self.spatial_pruning and self.compat_threshold > 0:
+                    pairs = self._score_candidate_pairs(straight, self.get_candidate_pairs(straight, lo, hi))
+                else:
+                    scores = self.pair_compatibility(src[lo:hi, None], dst[lo:hi, None], src[None, lo:],
+                                                     dst[None, lo:])
+                    rows, cols = np.nonzero(np.triu(scores > self.compat_threshold, k=1))
+                    pairs = np.stack([rows + lo, cols + lo], axis=-1)
+                f.write(np.ascontiguousarray(pairs, dtype=np.int32).tobytes())
+                n_pairs += len(pairs)
+        return n_pairs
+
+    # Turns pairs.int32 into the symmetric neighbour lists of Fdeb.neighbor_lists, indptr.npy and indices.npy, with
+    # indices written straight into its memory-mapped file
+    def write_neighbors(self, n_edges: int, n_pairs: int):
+        pairs = np.memmap(self.path('pairs.int32'), dtype=np.int32, mode='r').reshape(-1, 2) \
+            if n_pairs else np.zeros((0, 2), dtype=np.int32)
+        indices = np.lib.format.open_memmap(self.path('indices.npy'), mode='w+', dtype=np.int32,
+                                            shape=(2 * n_pairs,))
+        indptr, indices = self.neighbor_lists(n_edges, pairs, indices)
+        np.save(self.path('indptr.npy'), indptr)
+        indices.flush()
+
+    def load_state(self, key: str):
+        try:
+            with open(self.path('state.json')) as f:
+                state = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return None
+        if state.get('key') != key:
+            return None
+        if state['cycle'] >= 0 and not os.path.exists(self.path(f"cycle_{state['cycle']}.npy")):
+            return None
+        return state
+
+    # Written to a temporary file and renamed, so a crash never leaves a partial state behind
+    def save_state(self, state: dict):
+        with open(self.path('state.json.tmp'), 'w') as f:
+            json.dump(state, f)
+        os.replace(self.path('state.json.tmp'), self.path('state.json'))
+
+    # Removes the files of an earlier run
+    def clear(self):
+        for name in os.listdir(self.directory):
+            if name.startswith(('cycle_', 'relax_', 'state.json')) or name in (
+                    'pairs.int32', 'indptr.npy', 'indices.npy', 'bundled.npy'):
+                os.remove(self.path(name))
+
+
+# Compares the out-of-core engine with in-memory Fdeb on the airlines dataset with the GUI settings, then
+# interrupts a run after its third cycle and resumes it
+if __name__ == '__main__':
+    import tempfile
+
+    from airline_dataset import AirlineDataset
+    from layout import GraphLayout
+
+    edges = GraphLayout(AirlineDataset("data/airlines.graphml"), 1000, 1000, 20).edge_coords
+
+    def configure(fdeb: Fdeb) -> Fdeb:
+        fdeb.n_cycles, fdeb.n_iter = 6, 60
+        return fdeb
+
+    start = time.perf_counter()
+    expected = configure(Fdeb()).my_fdeb(edges.copy())
+    print(f"in memory:   {time.perf_counter() - start:.2f} s")
+
+    with tempfile.TemporaryDirectory() as directory:
+        fdeb = configure(OutOfCoreFdeb(directory))
+        fdeb.block_size = 512
+        start = time.perf_counter()
+        result = fdeb.my_fdeb(edges.copy())
+        print(f"out of core: {time.perf_counter() - start:.2f} s, max difference {np.abs(result - expected).max():.2e}")
+
+        class Interrupt(Exception):
+            pass
+
+        def interrupt(event: dict):
+            if event['event'] == 'cycle' and event['cycle'] == 2:
+                raise Interrupt()
+
+        fdeb = configure(OutOfCoreFdeb(os.path.join(directory, 'resumed')))
+        fdeb.callbacks.append(interrupt)
+        try:
+            fdeb.my_fdeb(edges.copy())
+        except Interrupt:
+            pass
+        fdeb.callbacks = []
+        result = fdeb.my_fdeb(edges.copy())
+        print(f"resumed after cycle 2: {fdeb.iterations} iterations, "
+              f"max difference {np.abs(result - expected).max():.2e}")
@@ -0,0 +1,159 @@
+import multiprocessing as mp
+import os
+import time
+from multiprocessing import resource_tracker, shared_memory
+
+import numpy as np
+
+from fdeb import Fdeb
+
+
+# Per-process state of the pool workers: the Fdeb configuration and the shared arrays attached so far
+_worker_fdeb = None
+_worker_arrays = {}
+
+
+class SharedArray:
+    def __init__(self, shape: tuple, dtype=np.float64, name: str = None):
+        size = max(1, int(np.prod(shape)) * np.dtype(dtype).itemsize)
+        self.owner = name is None
+        self.shm = shared_memory.SharedMemory(name=name, create=self.owner, size=size)
+        self.array = np.ndarray(shape, dtype=dtype, buffer=self.shm.buf)
+        self.spec = (self.shm.name, shape, np.dtype(dtype).str)
+
+    def close(self):
+        del self.array
+        self.shm.close()
+        if self.owner:
+            self.shm.unlink()
+
+
+class ParallelFdeb(Fdeb):
+    def __init__(self, n_workers: int = None):
+        super(ParallelFdeb, self).__init__()
+        self.n_workers = n_workers or os.cpu_count()
+        self.sparse_compat = True
+        self._pool = None
+        self._shared = {}
+        self._neighbors = None
+
+    def my_fdeb(self, edges):
+        if self.n_workers <= 1:
+            return super().my_fdeb(edges)
+        if not self.sparse_compat:
+            raise ValueError('Workers shard the sparse compatible pairs, '
+                             'the dense compatibility matrix is not supported')
+
+        # Workers must share the parent's resource tracker, otherwise each of them starts its own one which
+        # unlinks the attached segments as soon as the worker exits
+        resource_tracker.ensure_running()
+        self._pool = mp.get_context('fork').Pool(self.n_workers, initializer=_init_worker, initargs=(self,))
+        try:
+            return np.array(super().my_fdeb(edges))
+        finally:
+            self._pool.terminate()
+            self._pool = None
+            self._neighbors = None
+            for shared in self._shared.values():
+                shared.close()
+            self._shared = {}
+
+    # While the pool is running every subdivided edge array lives in shared memory, so the in-place update
+    # in my_fdeb is directly visible to the workers. It is shared in the bundling dtype, so that my_fdeb does not
+    # cast it into a private copy.
+    def subdivide_edges(self, edges: np.ndarray, num_points: int) -> np.ndarray:
+        new_points = super().subdivide_edges(edges, num_points)
+        if self._pool is None:
+            return new_points
+        return self._share('edges', new_points.astype(self.dtype, copy=False))
+
+    def compute_forces_sparse(self, e: np.ndarray, e_pairs: np.ndarray, kp: np.ndarray) -> np.ndarray:
+        if self._pool is None:
+            return super().compute_forces_sparse(e, e_pairs, kp)
+
+        if self._shared.get('edges') is None or self._shared['edges'].array is not e:
+            e = self._share('edges', e)
+        if self._neighbors is not e_pairs:
+            self._share_neighbors(e.shape[0], e_pairs)
+        if self._shared.get('kp') is None or not np.array_equal(self._shared['kp'].array, kp):
+            self._share('kp', kp)
+        if self._shared.get('forces') is None or self._shared['forces'].array.shape != e.shape:
+            self._share('forces', np.zeros_like(e))
+
+        specs = {name: shared.spec for name, shared in self._shared.items()}
+        self._pool.map(_shard_forces, [(specs, lo, hi) for lo, hi in self._shards()])
+
+        return self._shared['forces'].array
+
+    def _share(self, name: str, values: np.ndarray) -> np.ndarray:
+        shared = self._shared.get(name)
+        if shared is None or shared.array.shape != values.shape or shared.array.dtype != values.dtype:
+            if shared is not None:
+                shared.close()
+            shared = self._shared[name] = SharedArray(values.shape, values.dtype)
+        shared.array[...] = values
+        return shared.array
+
+    # Workers own a contiguous range of target edges and need every compatible pair touching them, so the
+    # upper-triangle pair list is turned into symmetric CSR neighbour lists
+    def _share_neighbors(self, n_edges: int, e_pairs: np.ndarray):
+        indptr, indices = self.neighbor_lists(n_edges, e_pairs)
+        self._share('indptr', indptr)
+        self._share('indices', indices)
+        self._neighbors = e_pairs
+
+    # Splits the edges into one contiguous shard per worker with roughly equal work, counting
+    # one unit per edge (springs) and one per neighbour (electrostatics)
+    def _shards(self) -> list:
+        indptr = self._shared['indptr'].array
+        n_edges = len(indptr) - 1
+        work = indptr + np.arange(n_edges + 1)
+        bounds = np.searchsorted(work, np.linspace(0, work[-1], self.n_workers + 1))
+        bounds[0], bounds[-1] = 0, n_edges
+        return [(lo, hi) for lo, hi in zip(bounds[:-1], bounds[1:]) if hi > lo]
+
+
+def _init_worker(fdeb: ParallelFdeb):
+    global _worker_fdeb
+    _worker_fdeb = fdeb
+    _worker_arrays.clear()
+
+
+def _attach(spec: tuple) -> np.ndarray:
+    name, shape, dtype = spec
+    if name not in _worker_arrays:
+        _worker_arrays[name] = SharedArray(shape, dtype, name=name)
+    return _worker_arrays[name].array
+
+
+def _shard_forces(task: tuple):
+    specs, lo, hi = task
+    e = _attach(specs['edges'])
+    kp = _attach(specs['kp'])
+    indptr = _attach(specs['indptr'])
+    indices = _attach(specs['indices'])
+    out = _attach(specs['forces'])
+
+    _worker_fdeb.compute_forces_range(e, indptr, indices, kp, lo, hi, out=out[lo:hi])
+
+
+# Scaling benchmark: bundles the airlines dataset with 1..N workers and reports the speedup over one worker
+if __name__ == '__main__':
+    from airline_dataset import AirlineDataset
+    from layout import GraphLayout
+
+    edges = GraphLayout(AirlineDataset("data/airlines.graphml"), 1000, 1000, 20).edge_coords
+    max_workers = os.cpu_count()
+    worker_counts = sorted({1, *[2 ** k for k in range(1, max_workers.bit_length())], max_workers})
+
+    reference = None
+    for n_workers in worker_counts:
+        fdeb = ParallelFdeb(n_workers)
+        start = time.perf_counter()
+        result = fdeb.my_fdeb(edges.copy())
+        elapsed = time.perf_counter() - start
+
+        if reference is None:
+            reference = (elapsed, result)
+        print(f"workers={n_workers:3d}  time={elapsed:8.2f}s  speedup={reference[0] / elapsed:5.2f}x  "
+              f"max_diff={np.abs(result - reference[1]).max():.2e}")
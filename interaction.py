@@ -0,0 +1,56 @@
+import numpy as np
+
+
+# Lookup structures for interacting with airports: CSR adjacency from airport to incident edge ids and a uniform
+# grid over airport positions for picking. Both are built once from the layout arrays, so selecting or hovering
+# an airport costs O(degree) no matter how many edges the scene holds.
+class InteractionIndex:
+    def __init__(self, x: np.ndarray, y: np.ndarray, edge_array: np.ndarray, radii: np.ndarray):
+        self.positions = np.stack([x, y], axis=-1)
+        self.radii = np.asarray(radii, dtype=np.float64)
+        n_nodes = len(self.positions)
+
+        # Airport -> incident edge ids, a self-loop is listed once
+        edge_array = np.asarray(edge_array, dtype=np.int64)
+        edge_ids = np.arange(len(edge_array))
+        not_loop = edge_array[:, 0] != edge_array[:, 1]
+        airports = np.concatenate([edge_array[:, 0], edge_array[not_loop, 1]])
+        incident = np.concatenate([edge_ids, edge_ids[not_loop]])
+        order = np.argsort(airports, kind='stable')
+        self.edge_ids = incident[order]
+        self.indptr = np.zeros(n_nodes + 1, dtype=np.int64)
+        self.indptr[1:] = np.cumsum(np.bincount(airports, minlength=n_nodes))
+
+        # Grid with cells as large as the biggest marker, so every marker containing a point overlaps
+        # the 3 x 3 cells around it
+        self.cell = max(2 * float(self.radii.max(initial=0)), 1e-9)
+        self.origin = self.positions.min(axis=0) if n_nodes else np.zeros(2)
+        cells = np.floor((self.positions - self.origin) / self.cell).astype(np.int64)
+        self.grid = {}
+        for airport, (cx, cy) in enumerate(cells.tolist()):
+            self.grid.setdefault((cx, cy), []).append(airport)
+
+    def incident_edges(self, airport: int) -> np.ndarray:
+        return self.edge_ids[self.indptr[airport]:self.indptr[airport + 1]]
+
+    # Union of the incident edges of several airports, e.g. all routes of a set of hubs
+    def incident_edges_of(self, airports) -> np.ndarray:
+        airports = list(airports)
+        if not airports:
+            return np.zeros(0, dtype=np.int64)
+        return np.unique(np.concatenate([self.incident_edges(airport) for airport in airports]))
+
+    # Nearest airport whose marker, grown by tolerance, contains the point, or None
+    def pick(self, px: float, py: float, tolerance: float = 0.0):
+        cx, cy = np.floor((np.array([px, py]) - self.origin) / self.cell).astype(np.int64).tolist()
+        reach = 1 + int(np.ceil(tolerance / self.cell))
+        best, best_dist = None, np.inf
+
+        for gx in range(cx - reach, cx + reach + 1):
+            for gy in range(cy - reach, cy + reach + 1):
+                for airport in self.grid.get((gx, gy), ()):
+                    dist = np.hypot(self.positions[airport, 0] - px, self.positions[airport, 1] - py)
+                    if dist <= self.radii[airport] + tolerance and dist < best_dist:
+                        best, best_dist = airport, dist
+
+        return best
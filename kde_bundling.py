@@ -0,0 +1,180 @@
+import time
+
+import numpy as np
+from tqdm import tqdm
+
+from fdeb import EdgeBundler, Fdeb
+
+
+# Image-space edge bundling by kernel density estimation (KDEEB), with the input and output of Fdeb.my_fdeb. Every
+# cycle splats the interior subdivision points of all edges into a density grid and smooths it with a Gaussian,
+# applied as a product in the Fourier domain. Each of its iterations then moves the points a fixed fraction of the
+# kernel width up the density gradient, smooths the polylines and resamples them with subdivide_edges, so they stay
+# evenly spaced. The kernel shrinks from cycle to cycle. An iteration costs O(E * P) and a cycle O(G log G) on top
+# for a grid of G cells, there are no edge pairs. Bundles form wherever edges run close together, whichever way
+# they point.
+class KdeBundling(EdgeBundler):
+    def __init__(self):
+        super(KdeBundling, self).__init__()
+        self.n_cycles = 10
+        self.n_iter = 3
+        self.n_points = 34
+        self.grid_size = 512  # cells along the larger side of the layout
+        self.bandwidth = 0.05  # kernel standard deviation of the first cycle as a fraction of the larger side
+        self.bandwidth_decay = 0.75
+        self.step = 0.5  # distance a point moves per iteration as a fraction of the kernel standard deviation
+        self.smoothing = 0.5
+
+    def hyperparameters(self) -> dict:
+        return {
+            'n_cycles': self.n_cycles,
+            'n_iter': self.n_iter,
+            'n_points': self.n_points,
+            'grid_size': self.grid_size,
+            'bandwidth': self.bandwidth,
+            'bandwidth_decay': self.bandwidth_decay,
+            'step': self.step,
+            'smoothing': self.smoothing,
+        }
+
+    def my_fdeb(self, edges):
+        monitored = self.monitored()
+        run_start = time.perf_counter()
+        self.snapshots = []
+        self.iterations = 0
+        self.iterations_saved = 0
+
+        edges = np.asarray(edges, dtype=np.float64)
+        extent = max(float(np.ptp(edges[..., 0])), float(np.ptp(edges[..., 1])), 1e-9)
+        cell = extent / self.grid_size
+        sigma = self.bandwidth * extent
+
+        # The grid reaches three kernel widths past the layout, so the smoothing never wraps around
+        margin = 3 * sigma
+        origin = edges.min(axis=(0, 1)) - margin
+        shape = tuple(int(n) for n in np.ceil((np.ptp(edges, axis=(0, 1)) + 2 * margin) / cell)[::-1] + 1)
+        edges = self.subdivide_edges(edges, self.n_points)
+
+        if monitored:
+            self.emit({'event': 'start', 'n_edges': len(edges), 'grid_shape': shape})
+
+        for cycle in tqdm(range(self.n_cycles)):
+            cycle_start = time.perf_counter()
+            gradient = self.density_gradient(edges, origin, cell, shape, sigma)
+            density_seconds = time.perf_counter() - cycle_start
+
+            for epoch in range(self.n_iter):
+                step = self.advect(edges, gradient, origin, cell, self.step * sigma)
+                self.smooth(edges)
+                edges = self.subdivide_edges(edges, self.n_points)
+                self.iterations += 1
+
+                if monitored:
+                    displacements = np.linalg.norm(step, axis=-1)
+                    event = {'event': 'iteration', 'cycle': cycle, 'iteration': epoch,
+                             'mean_displacement': float(displacements.mean()),
+                             'max_displacement': float(displacements.max())}
+                    if self.snapshot_every > 0 and self.iterations % self.snapshot_every == 0:
+                        event['edges'] = edges.copy()
+                        event['snapshot'] = len(self.snapshots)
+                        self.snapshots.append(event['edges'])
+                    self.emit(event)
+
+            if monitored:
+                self.emit({'event': 'cycle', 'cycle': cycle, 'num_points': self.n_points, 'n_iter': self.n_iter,
+                           'bandwidth': sigma, 'density_seconds': density_seconds,
+                           'advect_seconds': time.perf_counter() - cycle_start - density_seconds,
+                           'edges': edges.copy()})
+
+            sigma *= self.bandwidth_decay
+
+        if monitored:
+            self.emit({'event': 'end', 'iterations': self.iterations, 'iterations_saved': 0,
+                       'seconds': time.perf_counter() - run_start})
+
+        return edges
+
+    # Splats the interior points into the (rows x cols) grid, smooths it with a Gaussian of standard deviation sigma
+    # and returns its (2 x rows x cols) gradient along x and y
+    def density_gradient(self, edges: np.ndarray, origin: np.ndarray, cell: float, shape: tuple,
+                         sigma: float) -> np.ndarray:
+        points = edges[:, 1:-1].reshape(-1, 2)
+        cols, rows = np.floor((points - origin) / cell).astype(np.int64).T
+        inside = (rows >= 0) & (rows < shape[0]) & (cols >= 0) & (cols < shape[1])
+        density = np.bincount(rows[inside] * shape[1] + cols[inside], minlength=shape[0] * shape[1])
+        density = density.reshape(shape).astype(np.float64)
+
+        # The Fourier transform of a Gaussian is a Gaussian, and it factors into one per axis
+        s = sigma / cell
+        fy = np.exp(-2 * (np.pi * s * np.fft.fftfreq(shape[0])) ** 2)
+        fx = np.exp(-2 * (np.pi * s * np.fft.rfftfreq(shape[1])) ** 2)
+        density = np.fft.irfft2(np.fft.rfft2(density) * fy[:, None] * fx[None, :], s=shape)
+
+        gy, gx = np.gradient(density)
+        return np.stack([gx, gy])
+
+    # Moves the interior points distance along the normalised, bilinearly interpolated gradient, in place. Returns
+    # the (E x P - 2 x 2) steps.
+    def advect(self, edges: np.ndarray, gradient: np.ndarray, origin: np.ndarray, cell: float,
+               distance: float) -> np.ndarray:
+        points = edges[:, 1:-1]
+        x, y = np.moveaxis((points - origin) / cell - 0.5, -1, 0)
+        x = np.clip(x, 0, gradient.shape[2] - 1.001)
+        y = np.clip(y, 0, gradient.shape[1] - 1.001)
+        x0, y0 = x.astype(np.int64), y.astype(np.int64)
+        tx, ty = (x - x0)[..., None], (y - y0)[..., None]
+
+        g = np.moveaxis(gradient, 0, -1)
+        g = ((1 - ty) * ((1 - tx) * g[y0, x0] + tx * g[y0, x0 + 1])
+             + ty * ((1 - tx) * g[y0 + 1, x0] + tx * g[y0 + 1, x0 + 1]))
+        step = distance * g / (np.linalg.norm(g, axis=-1, keepdims=True) + 1e-12)
+        points += step
+        return step
+
+    # Laplacian smoothing of the interior points towards the midpoint of their neighbours, in place
+    def smooth(self, edges: np.ndarray):
+        midpoints = (edges[:, :-2] + edges[:, 2:]) / 2
+        edges[:, 1:-1] += self.smoothing * (midpoints - edges[:, 1:-1])
+
+
+# Compares KDE bundling with FDEB on the airlines dataset with the GUI settings: runtime, bundle tightness as the
+# mean distance between FDEB-compatible edges, ink as the total length of the rasterised edges and the scaling of
+# KDE bundling on synthetic networks. Writes both results as PNG for a visual comparison.
+if __name__ == '__main__':
+    import os
+
+    from airline_dataset import AirlineDataset
+    from benchmark import SyntheticRoutes
+    from layout import GraphLayout
+    from multilevel import polyline_distance
+    import export
+
+    os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+    os.makedirs('output', exist_ok=True)
+    dataset = AirlineDataset("data/airlines.graphml")
+    layout = GraphLayout(dataset, 1000, 1000, 20)
+    edges = layout.edge_coords
+    pairs = Fdeb().get_sparse_edge_compatibility(edges)
+
+    fdeb = Fdeb()
+    fdeb.n_cycles, fdeb.n_iter = 6, 60
+
+    for name, engine in [('fdeb', fdeb), ('kde', KdeBundling())]:
+        start = time.perf_counter()
+        result = engine.my_fdeb(edges.copy())
+        elapsed = time.perf_counter() - start
+        tightness = polyline_distance(result[pairs[:, 0], 1:-1], result[pairs[:, 1], 1:-1]).mean()
+        # Pixels of a 1000 x 1000 raster covered by the edges, drawn as dense point samples
+        samples = Fdeb().subdivide_edges(result, 200).reshape(-1, 2)
+        pixels = np.floor((samples - samples.min(axis=0)) / np.ptp(samples, axis=0).max() * 999).astype(np.int64)
+        ink = len(np.unique(pixels[:, 0] * 1000 + pixels[:, 1]))
+        diff_to_straight = np.median(polyline_distance(result, Fdeb().subdivide_edges(edges, result.shape[1])))
+        export.save_png(f'output/airlines_{name}.png', result, layout)
+        print(f"{name:5s} time={elapsed:6.2f}s  tightness={tightness:6.1f}  ink={ink} px  "
+              f"median_diff_to_straight={diff_to_straight:6.1f}")
+
+    for n_edges in (2000, 10000, 50000):
+        synthetic = GraphLayout(SyntheticRoutes(n_edges), 1000, 1000, 20).edge_coords
+        start = time.perf_counter()
+        KdeBundling().my_fdeb(synthetic)
+        print(f"kde on {n_edges} synthetic edges: {time.perf_counter() - start:.2f} s")
@@ -0,0 +1,42 @@
+import numpy as np
+
+
+def node_degrees(edge_array: np.ndarray, n_nodes: int) -> np.ndarray:
+    # A self-loop touches its airport once, not twice
+    loops = edge_array[edge_array[:, 0] == edge_array[:, 1], 0]
+    return np.bincount(edge_array.ravel(), minlength=n_nodes) - np.bincount(loops, minlength=n_nodes)
+
+
+# Every route grows the airport marker by 1 %, up to max_size
+def airport_sizes(degrees: np.ndarray, size: float = 10, growth: float = 1.01, max_size: float = 100) -> np.ndarray:
+    return np.minimum(size * growth ** degrees.astype(np.float64), max_size)
+
+
+def mercator_projection(longitude: np.ndarray, latitude: np.ndarray, width: float, height: float) -> tuple:
+    x = (longitude + 180) * (width / 360)
+    y = (180 / np.pi) * np.log(np.tan(np.pi / 4 + latitude * np.pi / 360))
+    y = (height / 2) - (height * y / (2 * 180))
+    return x, y
+
+
+def edge_coords(x: np.ndarray, y: np.ndarray, edge_array: np.ndarray) -> np.ndarray:
+    return np.stack([x, y], axis=-1)[edge_array]
+
+
+# Scene layout of a dataset: projected airport positions, marker sizes and the E x 2 x 2 straight edges.
+# Shared by the Qt window and the headless pipeline.
+class GraphLayout:
+    def __init__(self, dataset, width: float, height: float, scale_factor: float = 20):
+        self.width = width
+        self.height = height
+        self.scale_factor = scale_factor
+
+        x, y = mercator_projection(np.asarray(dataset.longitude), np.asarray(dataset.latitude), width, height)
+        self.x = x * scale_factor
+        self.y = y * scale_factor
+        self.degrees = node_degrees(np.asarray(dataset.edge_array), dataset.n_nodes)
+        self.sizes = airport_sizes(self.degrees)
+        self.edge_coords = edge_coords(self.x, self.y, np.asarray(dataset.edge_array))
+
+    def projection(self) -> dict:
+        return {'name': 'mercator', 'width': self.width, 'height': self.height, 'scale_factor': self.scale_factor}
@@ -3,23 +3,39 @@ import sys
 import math
 import numpy as np
 from PySide6.QtCore import Qt
-from PySide6.QtGui import QBrush, QPen, QTransform, QPainter, QSurfaceFormat, QColor
-from PySide6.QtSvg import QSvgGenerator
+from PySide6.QtGui import QBrush, QPen, QPainter, QSurfaceFormat, QColor
 from PySide6.QtWidgets import (QApplication, QMainWindow, QGraphicsScene, QGraphicsView, QVBoxLayout, QWidget,
                                QHBoxLayout, QListWidget, QListWidgetItem, QGraphicsEllipseItem, QPushButton,
-                               QMessageBox, QGraphicsLineItem, QGraphicsTextItem, QFileDialog)
+                               QMessageBox, QGraphicsTextItem, QFileDialog, QAbstractItemView, QFormLayout,
+                               QDoubleSpinBox, QSpinBox, QLabel, QComboBox)
 from PySide6.QtOpenGLWidgets import QOpenGLWidget
 from airline_dataset import AirlineDataset
+from bundle_cache import BundleCache
+from bundle_worker import BundleWorker
+from edge_layer import EdgeLayer
+import export
 from fdeb import Fdeb
+from interaction import InteractionIndex
+from kde_bundling import KdeBundling
+from layout import GraphLayout
+from spatial_index import declutter
 
-dataset = AirlineDataset("./data/airlines.graphml")
+dataset = AirlineDataset("./data/airlines.graphml", sidecar=True)
+bundle_cache = BundleCache("./data/cache")
 
 class VisGraphicsScene(QGraphicsScene):
     def __init__(self):
         super(VisGraphicsScene, self).__init__()
         self.city_items = {}
-        self.edge_lines = {}
-        self.selection = None
+        self.airport_items = {}
+        self.edge_layer = None
+        self.index = None
+        self.label_items = []
+        self.label_shown = None
+        self.min_label_pixels = 5  # labels whose text would be smaller on screen are hidden
+        self.selection = []
+        self.hovered = None
+        self.pick_tolerance = 5
         self.wasDragg = False
 
         color = QColor(255, 255, 0, 160)  # yellow color with a bit of opacity
@@ -33,32 +49,57 @@ class VisGraphicsScene(QGraphicsScene):
         line_color = QColor(255, 0, 0, 60)
         self.line_pen = QPen(line_color)
 
-    def mouseReleaseEvent(self, event):
-        if self.wasDragg:
-            return
-        if self.selection:
-            self.selection.setPen(self.pen)
-            self.selection.setBrush(self.brush)
+        hover_color = QColor(255, 255, 255, 120)
+        self.hover_pen = QPen(hover_color)
+
+    def select_airports(self, airports):
+        for city_idx in self.selection:
+            self.airport_items[city_idx].setPen(self.pen)  # Reset previous selection
+            self.airport_items[city_idx].setBrush(self.brush)  # Reset previous selection
+
+        self.selection = list(airports)
+        for city_idx in self.selection:
+            self.airport_items[city_idx].setPen(self.selected_pen)  # Highlight selected city
+            self.airport_items[city_idx].setBrush(self.selected_brush)  # Highlight selected city
 
-            city_idx = self.selection.data(1)
-            edge_indicies = self.city_items[city_idx]["edges"]
+        self.edge_layer.set_selected(self.index.incident_edges_of(self.selection))
 
-            for idx in edge_indicies:
-                for line in self.edge_lines[idx]:
-                    line.setPen(self.line_pen)
+    # Labels overlapping a label of a bigger airport are never shown, they would overlap at every zoom level since
+    # they scale with the view. The rest is shown once it is large enough on screen to be read.
+    def update_labels(self, scale):
+        if self.label_shown is None:
+            boxes = [item.sceneBoundingRect().getCoords() for item in self.label_items]
+            self.label_shown = declutter(np.array(boxes), [item.scale() for item in self.label_items])
 
-        item = self.itemAt(event.scenePos(), QTransform())
-        if item:
-            city_idx = item.data(1)
-            item.setPen(self.selected_pen)  # Highlight selected city
-            item.setBrush(self.selected_brush)  # Highlight selected city
-            self.selection = item
+        for item, shown in zip(self.label_items, self.label_shown.tolist()):
+            item.setVisible(shown and item.font().pointSizeF() * item.scale() * scale >= self.min_label_pixels)
 
-            edge_indicies = self.city_items[city_idx]["edges"]
+    def mouseReleaseEvent(self, event):
+        if self.wasDragg:
+            return
+
+        pos = event.scenePos()
+        city_idx = self.index.pick(pos.x(), pos.y(), self.pick_tolerance)
+
+        # Ctrl+click adds or removes an airport, e.g. to show all routes of a set of hubs
+        if event.modifiers() & Qt.ControlModifier:
+            selection = [idx for idx in self.selection if idx != city_idx]
+            if city_idx is not None and city_idx not in self.selection:
+                selection.append(city_idx)
+            self.select_airports(selection)
+        else:
+            self.select_airports([] if city_idx is None else [city_idx])
+
+    def mouseMoveEvent(self, event):
+        super().mouseMoveEvent(event)
+        if event.buttons() != Qt.NoButton:
+            return
 
-            for idx in edge_indicies:
-                for line in self.edge_lines[idx]:
-                    line.setPen(self.selected_pen)
+        pos = event.scenePos()
+        city_idx = self.index.pick(pos.x(), pos.y(), self.pick_tolerance)
+        if city_idx != self.hovered:
+            self.hovered = city_idx
+            self.edge_layer.set_hovered([] if city_idx is None else self.index.incident_edges(city_idx))
 
 class VisGraphicsView(QGraphicsView):
     def __init__(self, scene, parent):
@@ -77,6 +118,7 @@ class VisGraphicsView(QGraphicsView):
     def wheelEvent(self, event):
         zoom = 1 + event.angleDelta().y() * 0.001
         self.scale(zoom, zoom)
+        self.myScene.update_labels(self.transform().m11())
 
     def mousePressEvent(self, event):
         self.startX = event.pos().x()
@@ -98,7 +140,7 @@ class MainWindow(QMainWindow):
     def __init__(self):
         super(MainWindow, self).__init__()
         self.airports = dataset.nodes
-        self.edge_lines = {}
+        self.worker = None
         self.setWindowTitle('Visualisation of U.S. air travel')
         self.createWidgets()
         self.generateAndMapData()
@@ -124,110 +166,81 @@ class MainWindow(QMainWindow):
 
         self.view = VisGraphicsView(self.scene, self)
         self.view.setViewport(gl)
+        self.view.viewport().setMouseTracking(True)  # hover highlighting needs move events without a button
         self.view.setBackgroundBrush(QColor(255, 255, 255))
         self.view.setGeometry(0, 0, 1000, 1000)
         self.view.scale(0.38, 0.38)
         self.view.setBackgroundBrush(QBrush(QColor(0, 0, 128, 255)))
         layout.addWidget(self.view)
 
+        panel = QVBoxLayout()
+        layout.addLayout(panel)
+
         self.cityListWidget = QListWidget()
+        self.cityListWidget.setSelectionMode(QAbstractItemView.ExtendedSelection)
         self.cityListWidget.itemClicked.connect(self.onCityListItemClicked)  # Connect signal to slot
-        layout.addWidget(self.cityListWidget)
+        panel.addWidget(self.cityListWidget)
+
+        # Bundling parameters, changing them takes effect with Rebundle
+        form = QFormLayout()
+        self.engineBox = QComboBox()
+        self.engineBox.addItems(["FDEB", "KDE"])
+        self.engineBox.currentTextChanged.connect(self.onEngineChanged)
+        form.addRow("Engine", self.engineBox)
+        self.kBox = QDoubleSpinBox(decimals=3, minimum=0.001, maximum=10, singleStep=0.01, value=0.1)
+        self.compatBox = QDoubleSpinBox(decimals=2, minimum=0, maximum=1, singleStep=0.05, value=0.5)
+        self.cyclesBox = QSpinBox(minimum=1, maximum=10, value=6)
+        self.iterBox = QSpinBox(minimum=1, maximum=500, value=60)
+        form.addRow("K", self.kBox)
+        form.addRow("Compatibility threshold", self.compatBox)
+        form.addRow("Cycles", self.cyclesBox)
+        form.addRow("Iterations", self.iterBox)
+        panel.addLayout(form)
+
+        buttons = QHBoxLayout()
+        rebundleButton = QPushButton("Rebundle")
+        rebundleButton.clicked.connect(self.startBundling)
+        cancelButton = QPushButton("Cancel")
+        cancelButton.clicked.connect(self.cancelBundling)
+        buttons.addWidget(rebundleButton)
+        buttons.addWidget(cancelButton)
+        panel.addLayout(buttons)
+
+        self.statusLabel = QLabel()
+        panel.addWidget(self.statusLabel)
 
         # Add a button to save the visualization
-        saveButton = QPushButton("Export SVG")
+        saveButton = QPushButton("Export SVG/PNG")
         saveButton.clicked.connect(self.saveVisualization)  # Connect signal to slot
-        layout.addWidget(saveButton)
+        panel.addWidget(saveButton)
 
 
         layout.setStretch(0, 5)  # Set stretch factor for visualization view
-        layout.setStretch(1, 1)  # Set stretch factor for list widget
+        layout.setStretch(1, 1)  # Set stretch factor for the side panel
 
     def saveVisualization(self):
         # Open a file dialog to choose the filename and location
-        filename, _ = QFileDialog.getSaveFileName(self, "Save Visualization", "", "SVG Files (*.svg)")
+        filename, selected_filter = QFileDialog.getSaveFileName(self, "Save Visualization", "",
+                                                                "SVG Files (*.svg);;PNG Files (*.png)")
         if filename:
             # Call the function to save the visualization
-            self.saveVisualizationToFile(filename)
+            self.saveVisualizationToFile(filename, 'png' if 'png' in selected_filter.lower() else 'svg')
 
-    def saveVisualizationToFile(self, filename):
+    def saveVisualizationToFile(self, filename, fmt='svg'):
         # Check if the filename has the correct extension
-        if not filename.endswith('.svg'):
-            filename += '.svg'
-
-        # Create a QSvgGenerator object
-        svgGenerator = QSvgGenerator()
-        svgGenerator.setFileName(filename)
-        svgGenerator.setSize(self.view.size())
-        svgGenerator.setViewBox(self.view.rect())
+        if not filename.endswith('.' + fmt):
+            filename += '.' + fmt
 
-        # Create a QPainter object to draw the QGraphicsView onto the SVG generator
-        painter = QPainter()
-        painter.begin(svgGenerator)
-        self.view.render(painter)
-        painter.end()
+        # Export the whole map straight from the bundled edge array instead of rendering the view
+        if fmt == 'png':
+            export.save_png(filename, self.edges_fdeb, self.layout, dataset.names, width=4000)
+        else:
+            export.save_svg(filename, self.edges_fdeb, self.layout, dataset.names)
 
     def onCityListItemClicked(self, item):
-        city_name = item.text()
-        if self.scene.selection:
-            self.scene.selection.setPen(self.scene.pen)  # Reset previous selection
-            self.scene.selection.setBrush(self.scene.brush)  # Reset previous selection
-
-            city_idx = self.scene.selection.data(1)
-            edge_indicies = self.airports[city_idx]["edges"]
-
-            for idx in edge_indicies:
-                for line in self.edge_lines[idx]:
-                    line.setPen(self.scene.line_pen)
-
-        city_item = self.scene.city_items.get(city_name)
-
-        if city_item:
-            city_idx = city_item.data(1)
-            city_item.setPen(self.scene.selected_pen)  # Highlight selected city
-            city_item.setBrush(self.scene.selected_brush)  # Highlight selected city
-            self.scene.selection = city_item
-
-            edge_indicies = self.airports[city_idx]["edges"]
-
-            for idx in edge_indicies:
-                for line in self.edge_lines[idx]:
-                    line.setPen(self.scene.selected_pen)
-
-    def get_airport_size(self, airport):
-        MAX_SIZE = 100
-        size = 10
-        for e in dataset.edges:
-            idx = airport["index"]
-            if idx == e[0] or idx == e[1]:
-                size *= 1.01
-
-        return min(size, MAX_SIZE)
-
-    def mercator_projection(self, longitude, latitude):
-        x = (longitude + 180) * (self.view.width() / 360)
-        y = (180 / math.pi) * math.log(math.tan(math.pi / 4 + latitude * math.pi / 360))
-        y = (self.view.height() / 2) - (self.view.height() * y / (2 * 180))
-        return x, y
-
-    def get_edge_coords(self):
-        edges = dataset.edges
-
-        coords = np.zeros((len(edges), 2, 2))
-        for i, e in enumerate(edges):
-            x1, y1 = self.airports[e[0]]["x"], self.airports[e[0]]["y"]
-            x2, y2 = self.airports[e[1]]["x"], self.airports[e[1]]["y"]
-
-            coords[i, 0, 0] = x1
-            coords[i, 0, 1] = y1
-            coords[i, 1, 0] = x2
-            coords[i, 1, 1] = y2
-
-            # this info is later used to highlight relevant edges for an airport
-            self.airports[e[0]]["edges"].append(i)
-            self.airports[e[1]]["edges"].append(i)
-
-        return coords
+        # Ctrl/Shift+click in the list selects several airports at once
+        city_names = [selected.text() for selected in self.cityListWidget.selectedItems()]
+        self.scene.select_airports([self.scene.city_items[name].data(1) for name in city_names])
 
     def generateAndMapData(self):
         self.airports.sort(key=lambda x: x['name'])
@@ -240,26 +253,26 @@ class MainWindow(QMainWindow):
         # Define scaling factor
         scale_factor = 20  # Adjust this value as needed
 
+        # Project all airports and compute marker sizes and edge coordinates at once
+        self.layout = GraphLayout(dataset, self.view.width(), self.view.height(), scale_factor)
+
         # Map data to graphical elements
         for city in self.airports:
-            # Convert latitude and longitude to scene coordinates
-            x, y = self.mercator_projection(city['longitude'], city['latitude'])
-
-            # Apply scaling factor
-            x *= scale_factor
-            y *= scale_factor
+            x = float(self.layout.x[city['index']])
+            y = float(self.layout.y[city['index']])
 
             city["x"] = x
             city["y"] = y
 
             # Add city circle
-            d = self.get_airport_size(city)
+            d = float(self.layout.sizes[city['index']])
             ellipse = self.scene.addEllipse(x - d / 2, y - d / 2, d, d, self.scene.pen, self.scene.brush)
             ellipse.setData(0, city['name'])  # Store the city name as custom data
             ellipse.setData(1, city['index'])  # Store the city name as custom data
 
             self.scene.city_items[city['name']] = ellipse  # Store the ellipse item
             self.scene.city_items[city['index']] = city  # Store the city item by index
+            self.scene.airport_items[city['index']] = ellipse  # Store the ellipse item by index
 
             # Add city label
             text = QGraphicsTextItem(city['name'])
@@ -267,44 +280,94 @@ class MainWindow(QMainWindow):
             text.setPos(x + 10, y - 10)  # Adjust position for label
             text.setScale(1 + (d-10) / 20)
             self.scene.addItem(text)
+            self.scene.label_items.append(text)
 
         # sort back to original order
         self.airports.sort(key=lambda x: x['index'])
-        edge_coords = self.get_edge_coords()
-
-        overflow_const = 100  # 10 worked for 60 its, not for 100
-        # PERFORM EDGE BUNDLING
-        edge_coords /= overflow_const  # prevent overflow
-
-        # mf = MyFdeb()
-        # edges_fdeb = mf.my_fdeb(edge_coords)
-        # print(edges_fdeb.shape)
-        # with open('edges_fdeb.npy', 'wb') as f:
-        #     np.save(f, edges_fdeb)
-
-        with open('data/edges_fdeb_best.npy', 'rb') as f:
-            edges_fdeb = np.load(f)
-
-        edges_fdeb *= overflow_const
-        edge_coords *= overflow_const
-
-        # edges_fdeb = edge_coords # switch bundled/not bundled
-
-        for i in range(edges_fdeb.shape[0]):
-            self.edge_lines[i] = []
-            for j in range(edges_fdeb.shape[1] - 1):
-                x1, y1 = edges_fdeb[i, j, :]
-                x2, y2 = edges_fdeb[i, j + 1, :]
-
-                line = QGraphicsLineItem(x1, y1, x2, y2)
-                line.setZValue(-50)  # Set a low Z-value for edges
-                line.setPen(self.scene.line_pen)
-
-                self.edge_lines[i].append(line)
+        self.scene.update_labels(self.view.transform().m11())
+
+        # Airport -> route adjacency and spatial lookup used for picking, hovering and highlighting
+        self.scene.index = InteractionIndex(self.layout.x, self.layout.y, dataset.edge_array, self.layout.sizes / 2)
+
+        # Start with straight edges, the bundling replaces them as it progresses
+        self.edges_fdeb = self.layout.edge_coords
+        self.scene.edge_layer = EdgeLayer(self.edges_fdeb, self.scene.line_pen, self.scene.selected_pen,
+                                          self.scene.hover_pen)
+        self.scene.addItem(self.scene.edge_layer)
+        self.startBundling()
+
+    # Shows the cycle and iteration defaults of the selected engine, K and the threshold only apply to FDEB
+    def onEngineChanged(self, engine):
+        kde = KdeBundling()
+        self.cyclesBox.setValue(6 if engine == "FDEB" else kde.n_cycles)
+        self.iterBox.setValue(60 if engine == "FDEB" else kde.n_iter)
+        self.kBox.setEnabled(engine == "FDEB")
+        self.compatBox.setEnabled(engine == "FDEB")
+
+    def makeFdeb(self):
+        if self.engineBox.currentText() == "KDE":
+            fdeb = KdeBundling()
+            fdeb.n_cycles = self.cyclesBox.value()
+            fdeb.n_iter = self.iterBox.value()
+            return fdeb
+
+        fdeb = Fdeb()
+        fdeb.K = self.kBox.value()
+        fdeb.compat_threshold = self.compatBox.value()
+        fdeb.n_cycles = self.cyclesBox.value()
+        fdeb.n_iter = self.iterBox.value()
+        return fdeb
+
+    # PERFORM EDGE BUNDLING in the background, a cached result is shown right away
+    def startBundling(self):
+        self.cancelBundling()
+        fdeb = self.makeFdeb()
+        edge_coords = self.layout.edge_coords.copy()
+
+        cached = bundle_cache.load(bundle_cache.key(fdeb, edge_coords, self.layout.projection()))
+        if cached is not None:
+            self.showEdges(cached)
+            self.statusLabel.setText("Bundled")
+            return
 
-                self.scene.addItem(line)
+        self.worker = BundleWorker(fdeb, edge_coords, bundle_cache, self.layout.projection(), parent=self)
+        self.worker.progress.connect(self.onBundlingProgress)
+        self.worker.done.connect(self.onBundlingDone)
+        self.worker.finished.connect(self.worker.deleteLater)
+        self.worker.start()
+        self.statusLabel.setText(f"Bundling: cycle 0/{fdeb.n_cycles}")
+
+    # The cancelled worker stops at its next iteration on its own, the window does not wait for it
+    def cancelBundling(self):
+        if self.worker is not None:
+            self.worker.requestInterruption()
+            self.worker = None
+            self.statusLabel.setText("Cancelled")
+
+    def onBundlingProgress(self, edges, levels, cycle):
+        # Signals that were already queued when the worker was cancelled are dropped
+        if self.sender() is not self.worker:
+            return
+        self.showEdges(edges, levels)
+        self.statusLabel.setText(f"Bundling: cycle {cycle + 1}/{self.worker.fdeb.n_cycles}")
 
-        self.scene.edge_lines = self.edge_lines
+    def onBundlingDone(self, edges, levels):
+        if self.sender() is not self.worker:
+            return
+        self.worker = None
+        self.showEdges(edges, levels)
+        self.statusLabel.setText("Bundled")
+
+    def showEdges(self, edges, levels=None):
+        self.edges_fdeb = edges
+        self.scene.edge_layer.set_edges(edges, levels)
+
+    def closeEvent(self, event):
+        self.cancelBundling()
+        for worker in self.findChildren(BundleWorker):
+            worker.requestInterruption()
+            worker.wait()
+        super().closeEvent(event)
 
 
 def main():
@@ -0,0 +1,54 @@
+import numpy as np
+
+
+# Douglas-Peucker simplification of all polylines of an (E x P x 2) array at once. Returns an (E x P) mask of the
+# points to keep, the endpoints are always kept.
+def simplify(edges: np.ndarray, tolerance: float) -> np.ndarray:
+    if tolerance < 0:
+        return np.ones(edges.shape[:2], dtype=bool)
+    return significance(edges, tolerance) > tolerance
+
+
+# Largest Douglas-Peucker tolerance at which every point of an (E x P x 2) array is still kept, infinite for the
+# endpoints, so that simplify(edges, t) is significance(edges) > t for every t >= 0 and one pass yields all levels of
+# detail. Each pass splits every segment of the current simplification at its farthest point, if that point is more
+# than tolerance away, so the number of passes is bounded by P. A split only happens if the one that created the
+# segment did, so the significance of a point is the smaller of its distance and the significance of the segment,
+# the lower one of its endpoints. Points that are not split above tolerance get 0.
+def significance(edges: np.ndarray, tolerance: float = 0.0) -> np.ndarray:
+    n_edges, n_points = edges.shape[:2]
+    result = np.zeros((n_edges, n_points))
+    result[:, 0] = result[:, -1] = np.inf
+    keep = np.zeros((n_edges, n_points), dtype=bool)
+    keep[:, 0] = keep[:, -1] = True
+    if n_points <= 2:
+        return result
+
+    index = np.arange(n_points)
+    rows = np.arange(n_edges)[:, None]
+
+    while True:
+        # Kept points enclosing each point
+        prev = np.maximum.accumulate(np.where(keep, index, 0), axis=1)
+        nxt = np.minimum.accumulate(np.where(keep, index, n_points - 1)[:, ::-1], axis=1)[:, ::-1]
+        start, end = edges[rows, prev], edges[rows, nxt]
+
+        # Distance of every point to the segment between its enclosing kept points
+        seg = end - start
+        seg_sq = np.sum(seg ** 2, axis=-1)
+        t = np.clip(np.sum((edges - start) * seg, axis=-1) / np.where(seg_sq > 0, seg_sq, 1), 0, 1)
+        dist = np.linalg.norm(edges - (start + t[..., None] * seg), axis=-1)
+        dist[keep] = -1
+
+        # Farthest point of every segment, segments are identified by their (edge, start point)
+        candidates = np.nonzero(dist > tolerance)
+        if len(candidates[0]) == 0:
+            return result
+
+        segment_ids = candidates[0] * n_points + prev[candidates]
+        order = np.lexsort((-dist[candidates], segment_ids))
+        first = np.ones(len(order), dtype=bool)
+        first[1:] = segment_ids[order][1:] != segment_ids[order][:-1]
+        split = candidates[0][order][first], candidates[1][order][first]
+        result[split] = np.minimum(dist[split], np.minimum(result[split[0], prev[split]], result[split[0], nxt[split]]))
+        keep[split] = True
@@ -0,0 +1,75 @@
+import numpy as np
+
+
+# Spatial index over axis-aligned boxes given as an (N x 4) array of left, top, right, bottom. Boxes are bucketed
+# into power-of-two size classes, like the candidate pairs of Fdeb, and every class gets a grid whose cells are at
+# least as large as its boxes. A box is stored once, in the cell of its top left corner, so it can only reach into
+# the next cell to the right and below, and a query visits the cells overlapping the query rectangle plus one
+# column and row before it. Cells are keyed column by column, so the cells of one column are a contiguous range
+# of the sorted keys.
+class BoxIndex:
+    def __init__(self, boxes: np.ndarray):
+        self.boxes = np.asarray(boxes, dtype=np.float64).reshape(-1, 4)
+        self.levels = []
+        if len(self.boxes) == 0:
+            return
+
+        extent = np.maximum(self.boxes[:, 2] - self.boxes[:, 0], self.boxes[:, 3] - self.boxes[:, 1])
+        # Boxes smaller than 2^-16 of the largest one are lumped into the lowest class
+        classes = np.ceil(np.log2(np.maximum(extent, max(extent.max(), 1e-9) * 2.0 ** -16))).astype(np.int64)
+        self.origin = self.boxes[:, :2].min(axis=0)
+
+        for size_class in np.unique(classes):
+            ids = np.nonzero(classes == size_class)[0]
+            cell = 2.0 ** size_class
+            cells = np.floor((self.boxes[ids, :2] - self.origin) / cell).astype(np.int64)
+            n_cols, n_rows = cells.max(axis=0) + 1
+            keys = cells[:, 0] * n_rows + cells[:, 1]
+            order = np.argsort(keys, kind='stable')
+            self.levels.append((cell, n_cols, n_rows, keys[order], ids[order]))
+
+    # Ids of the boxes overlapping the rectangle, in increasing order
+    def query(self, left: float, top: float, right: float, bottom: float) -> np.ndarray:
+        found = []
+        for cell, n_cols, n_rows, keys, ids in self.levels:
+            col_lo = max(int(np.floor((left - self.origin[0]) / cell)) - 1, 0)
+            col_hi = min(int(np.floor((right - self.origin[0]) / cell)), n_cols - 1)
+            row_lo = max(int(np.floor((top - self.origin[1]) / cell)) - 1, 0)
+            row_hi = min(int(np.floor((bottom - self.origin[1]) / cell)), n_rows - 1)
+            if col_lo > col_hi or row_lo > row_hi:
+                continue
+
+            # A query wider than the class has boxes is cheaper as a scan over all of them
+            if col_hi - col_lo + 1 >= len(ids):
+                found.append(ids)
+                continue
+
+            cols = np.arange(col_lo, col_hi + 1)
+            lo = np.searchsorted(keys, cols * n_rows + row_lo, side='left')
+            hi = np.searchsorted(keys, cols * n_rows + row_hi, side='right')
+            counts = hi - lo
+            offsets = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+            found.append(ids[np.repeat(lo, counts) + offsets])
+
+        if not found:
+            return np.zeros(0, dtype=np.int64)
+        candidates = np.concatenate(found)
+        boxes = self.boxes[candidates]
+        hit = (boxes[:, 0] <= right) & (boxes[:, 2] >= left) & (boxes[:, 1] <= bottom) & (boxes[:, 3] >= top)
+        return np.sort(candidates[hit])
+
+
+# Greedy label placement: labels are taken by decreasing priority and every label overlapping one that was already
+# taken is dropped. Returns the mask of the labels to show.
+def declutter(boxes: np.ndarray, priority: np.ndarray) -> np.ndarray:
+    boxes = np.asarray(boxes, dtype=np.float64).reshape(-1, 4)
+    shown = np.zeros(len(boxes), dtype=bool)
+    if len(boxes) == 0:
+        return shown
+
+    index = BoxIndex(boxes)
+    for label in np.argsort(-np.asarray(priority), kind='stable').tolist():
+        left, top, right, bottom = boxes[label].tolist()
+        overlapping = index.query(left, top, right, bottom)
+        shown[label] = not shown[overlapping].any()
+    return shown
@@ -0,0 +1,16 @@
+import os
+import sys
+
+import numpy as np
+import pytest
+
+# The modules live at the top level of the repository
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+# 300 routes between a dozen hubs of a 1000 x 1000 layout, jittered so that the edges bundle into a few trunks
+@pytest.fixture
+def hub_routes() -> np.ndarray:
+    rng = np.random.default_rng(0)
+    hubs = rng.uniform(0, 1000, (12, 2))
+    return hubs[rng.integers(0, len(hubs), (300, 2))] + rng.normal(0, 30, (300, 2, 2))
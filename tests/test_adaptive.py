@@ -0,0 +1,30 @@
+import numpy as np
+import pytest
+
+from fdeb import Fdeb
+
+
+def bundle(edges: np.ndarray, adaptive: bool) -> tuple:
+    fdeb = Fdeb()
+    fdeb.n_cycles, fdeb.n_iter = 5, 40
+    fdeb.adaptive = adaptive
+    return fdeb.my_fdeb(edges.copy()), fdeb
+
+
+def test_early_stopping_saves_iterations_with_bounded_deviation(hub_routes):
+    expected, fixed = bundle(hub_routes, adaptive=False)
+    bundled, adaptive = bundle(hub_routes, adaptive=True)
+
+    assert adaptive.iterations_saved > 0
+    assert adaptive.iterations + adaptive.iterations_saved == fixed.iterations
+    deviation = np.linalg.norm(bundled - expected, axis=-1)
+    assert np.percentile(deviation, 95) < 0.01 * np.ptp(hub_routes)
+
+
+@pytest.mark.parametrize('factor', [1e-3, 1e3])
+def test_early_stopping_is_independent_of_the_layout_size(hub_routes, factor):
+    bundled, fdeb = bundle(hub_routes, adaptive=True)
+    scaled, scaled_fdeb = bundle(hub_routes * factor, adaptive=True)
+
+    assert scaled_fdeb.iterations_saved == fdeb.iterations_saved
+    np.testing.assert_allclose(scaled / factor, bundled, rtol=0, atol=1e-4)
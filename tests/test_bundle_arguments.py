@@ -0,0 +1,32 @@
+import pytest
+
+from bundle import make_fdeb, parse_args
+from fdeb import Fdeb
+from fdeb_parallel import ParallelFdeb
+from kde_bundling import KdeBundling
+from multilevel import MultilevelFdeb
+
+
+@pytest.mark.parametrize('options', [
+    ['--n-levels', '2', '--workers', '4'],
+    ['--n-levels', '2', '--out-of-core', 'state'],
+    ['--out-of-core', 'state', '--workers', '2'],
+    ['--out-of-core', 'state', '--dense'],
+    ['--workers', '2', '--dense'],
+    ['--engine', 'kde', '--workers', '2'],
+    ['--out-of-core', 'state', '--adaptive', '--step-adaptation'],
+])
+def test_conflicting_options_are_rejected(options):
+    with pytest.raises(SystemExit) as error:
+        parse_args(['graph.graphml'] + options)
+    assert error.value.code == 2
+
+
+@pytest.mark.parametrize('options, engine', [
+    ([], Fdeb),
+    (['--n-levels', '2'], MultilevelFdeb),
+    (['--workers', '2'], ParallelFdeb),
+    (['--engine', 'kde'], KdeBundling),
+])
+def test_options_select_the_engine(options, engine):
+    assert type(make_fdeb(parse_args(['graph.graphml'] + options))) is engine
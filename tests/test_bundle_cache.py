@@ -0,0 +1,38 @@
+import numpy as np
+
+from bundle_cache import BundleCache
+
+
+# Engine stand-in that returns a fixed result and counts its runs
+class FixedEngine:
+    def __init__(self, result: np.ndarray):
+        self.result = result
+        self.runs = 0
+
+    def hyperparameters(self) -> dict:
+        return {}
+
+    def my_fdeb(self, edges):
+        self.runs += 1
+        return self.result.copy()
+
+
+def test_finite_result_is_served_from_the_cache(tmp_path):
+    edges = np.zeros((3, 2, 2))
+    engine = FixedEngine(np.ones((3, 4, 2)))
+    cache = BundleCache(str(tmp_path))
+
+    np.testing.assert_array_equal(cache.bundle(engine, edges), engine.result)
+    np.testing.assert_array_equal(cache.bundle(engine, edges), engine.result)
+    assert engine.runs == 1
+
+
+def test_non_finite_result_is_not_cached(tmp_path):
+    edges = np.zeros((3, 2, 2))
+    engine = FixedEngine(np.full((3, 4, 2), np.nan))
+    cache = BundleCache(str(tmp_path))
+
+    assert np.isnan(cache.bundle(engine, edges)).all()
+    assert cache.load(cache.key(engine, edges)) is None
+    cache.bundle(engine, edges)
+    assert engine.runs == 2
@@ -0,0 +1,153 @@
+import numpy as np
+import pytest
+
+from fdeb import Fdeb
+
+
+# The per-pair Python loops get_edge_compatibility replaced, kept as the reference it must agree with
+def edge_compatibility_loop(edges: np.ndarray, compat_threshold: float) -> np.ndarray:
+    vec = np.array([edge[-1] - edge[0] for edge in edges])
+    vec_norm = np.linalg.norm(vec, axis=1, keepdims=True)
+
+    # Angle compatability
+    compat_angle = np.abs(np.matmul(vec, np.transpose(vec)) / (np.matmul(vec_norm, np.transpose(vec_norm)) + 1e-8))
+
+    # Length compatibility
+    l_avg = (vec_norm + np.transpose(vec_norm)) / 2
+    compat_length = []
+
+    for i in range(len(vec_norm)):
+        row = []
+        for j in range(len(vec_norm)):
+            min_val = min(vec_norm[i], vec_norm[j])
+            max_val = max(vec_norm[i], vec_norm[j])
+            avg_val = l_avg[i][j]
+            comp_length = (2 / ((avg_val / (min_val + 1e-8)) + (max_val / (avg_val + 1e-8)) + 1e-8))[0]
+            row.append(comp_length)
+        compat_length.append(row)
+
+    compat_length = np.array(compat_length)
+
+    # Distance compatibility
+    midpoint = (edges[:, 0] + edges[:, -1]) / 2
+    midpoint_dist = np.linalg.norm(midpoint[None, :] - midpoint[:, None], axis=-1)
+    compat_dist = l_avg / (l_avg + midpoint_dist + 1e-8)
+
+    # Visibility compatibility
+    ap = edges[None, ...] - edges[:, None, None, 0]
+
+    # Calculate t
+    t = []
+    for i in range(len(vec)):
+        t_i = []
+        for j in range(len(edges)):
+            t_ij = []
+            for k in range(len(edges[0])):
+                numerator = sum(ap[i][j][k][l] * vec[i][l] for l in range(len(vec[0])))
+                denominator = sum(vec[i][l] ** 2 for l in range(len(vec[0]))) + 1e-8
+                t_ij.append(numerator / denominator)
+            t_i.append(t_ij)
+        t.append(t_i)
+    t = np.array(t)
+
+    # Calculate I
+    I = []
+    for i in range(len(edges)):
+        I_i = []
+        for j in range(len(edges)):
+            I_ij = []
+            for k in range(len(t[i][j])):
+                I_ijk = []
+                for l in range(len(vec[0])):
+                    I_ijk.append(edges[i][0][l] + t[i][j][k] * vec[i][l])
+                I_ij.append(I_ijk)
+            I_i.append(I_ij)
+        I.append(I_i)
+    I = np.array(I)
+
+    # Extract i0 and i1 from I
+    i0 = []
+    i1 = []
+
+    for i in range(len(I)):
+        i0_i = []
+        i1_i = []
+        for j in range(len(I[i])):
+            i0_i.append(I[i][j][0])
+            i1_i.append(I[i][j][1])
+        i0.append(i0_i)
+        i1.append(i1_i)
+
+    i0 = np.array(i0)
+    i1 = np.array(i1)
+
+    # Calculate the midpoint Im
+    Im = []
+    for i in range(len(i0)):
+        Im_i = []
+        for j in range(len(i0[i])):
+            Im_ij = [(i0[i][j][k] + i1[i][j][k]) / 2 for k in range(len(i0[i][j]))]
+            Im_i.append(Im_ij)
+        Im.append(Im_i)
+
+    Im = np.array(Im)
+
+    denom = np.sqrt(np.sum((i0 - i1) ** 2, axis=-1))
+    num = 2 * np.linalg.norm(midpoint[:, None, ...] - Im, axis=-1)
+    compat_visibility = np.maximum(0, 1 - num / (denom + 1e-8))
+    compat_visibility = np.minimum(compat_visibility, compat_visibility.T)
+    compatibility_matrix = compat_angle * compat_length * compat_dist * compat_visibility
+    compatibility_matrix = np.where(compatibility_matrix > compat_threshold, 1, 0)
+
+    return compatibility_matrix
+
+
+def random_edges(n_edges: int, seed: int) -> np.ndarray:
+    rng = np.random.default_rng(seed)
+    src = rng.uniform(0, 100, (n_edges, 2))
+    return np.stack([src, src + rng.normal(0, 10, (n_edges, 2)) * rng.exponential(1, (n_edges, 1))], axis=1)
+
+
+# Zero-length edges, duplicates, reversed duplicates, collinear and crossing edges
+def degenerate_edges() -> np.ndarray:
+    edges = [
+        [[0, 0], [0, 0]], [[0, 0], [0, 0]], [[5, 5], [5, 5]],
+        [[0, 0], [10, 0]], [[0, 0], [10, 0]], [[10, 0], [0, 0]],
+        [[20, 0], [30, 0]], [[0, 1], [10, 1]], [[5, -5], [5, 5]],
+        [[0, 0], [1e-9, 0]], [[0, 0], [1000, 1000]],
+    ]
+    return np.array(edges, dtype=np.float64)
+
+
+def exhaustive_pairs(fdeb: Fdeb, edges: np.ndarray) -> np.ndarray:
+    return np.argwhere(np.triu(fdeb.get_edge_compatibility(edges), 1))
+
+
+@pytest.mark.parametrize('threshold', [0.05, 0.2, 0.5, 0.8])
+@pytest.mark.parametrize('edges', [random_edges(600, 0), random_edges(300, 1), degenerate_edges()],
+                         ids=['random', 'random-small', 'degenerate'])
+def test_pruned_pairs_match_exhaustive(edges, threshold):
+    fdeb = Fdeb()
+    fdeb.compat_threshold = threshold
+    fdeb.compat_block_size = 64  # several candidate blocks
+
+    pruned = fdeb.get_sparse_edge_compatibility(edges)
+    fdeb.spatial_pruning = False
+    unpruned = fdeb.get_sparse_edge_compatibility(edges)
+
+    expected = exhaustive_pairs(fdeb, edges)
+    np.testing.assert_array_equal(pruned, expected)
+    np.testing.assert_array_equal(unpruned, expected)
+
+
+def test_no_edges():
+    assert Fdeb().get_sparse_edge_compatibility(np.zeros((0, 2, 2))).shape == (0, 2)
+
+
+@pytest.mark.parametrize('threshold', [0.05, 0.2, 0.5, 0.8])
+@pytest.mark.parametrize('edges', [random_edges(60, 2), degenerate_edges()], ids=['random', 'degenerate'])
+def test_matrix_matches_loop(edges, threshold):
+    fdeb = Fdeb()
+    fdeb.compat_threshold = threshold
+    fdeb.compat_block_size = 16  # several row blocks
+    np.testing.assert_array_equal(fdeb.get_edge_compatibility(edges), edge_compatibility_loop(edges, threshold))
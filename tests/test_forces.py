@@ -0,0 +1,79 @@
+import numpy as np
+import pytest
+
+from fdeb import Fdeb
+
+
+def bundling_state(n_edges: int = 300, n_points: int = 6, seed: int = 0) -> tuple:
+    rng = np.random.default_rng(seed)
+    src = rng.uniform(-1, 1, (n_edges, 2))
+    edges = np.stack([src, src + rng.normal(0, 0.3, (n_edges, 2))], axis=1)
+    fdeb = Fdeb()
+    fdeb.compat_threshold = 0.2
+    pairs = fdeb.get_sparse_edge_compatibility(edges)
+    edges = fdeb.subdivide_edges(edges, n_points) + rng.normal(0, 0.01, (n_edges, n_points, 2))
+    edges[:, [0, -1]] = fdeb.subdivide_edges(edges[:, [0, -1]], 2)
+    kp = rng.uniform(0.1, 1, (n_edges, 1, 1))
+    return fdeb, edges, pairs, kp
+
+
+def test_neighbor_lists_are_symmetric():
+    fdeb, edges, pairs, _ = bundling_state()
+    fdeb.pair_chunk_size = 7  # several chunks
+    indptr, indices = fdeb.neighbor_lists(len(edges), pairs)
+
+    rows = np.repeat(np.arange(len(edges)), np.diff(indptr))
+    found = set(zip(rows.tolist(), indices.tolist()))
+    assert found == set(map(tuple, pairs.tolist())) | set(map(tuple, pairs[:, ::-1].tolist()))
+    assert len(indices) == 2 * len(pairs)
+
+
+def dense_compatibility(n_edges: int, pairs: np.ndarray) -> np.ndarray:
+    compat = np.zeros((n_edges, n_edges), dtype=np.int64)
+    compat[pairs[:, 0], pairs[:, 1]] = compat[pairs[:, 1], pairs[:, 0]] = 1
+    return compat
+
+
+@pytest.mark.parametrize('dtype, tolerance', [(np.float64, 1e-10), (np.float32, 1e-3)])
+def test_sparse_forces_match_dense_forces(dtype, tolerance):
+    fdeb, edges, pairs, kp = bundling_state()
+    edges, kp = edges.astype(dtype), kp.astype(dtype)
+    expected = fdeb.compute_forces(edges, dense_compatibility(len(edges), pairs), kp).copy()
+    fdeb.pair_chunk_size = 50  # several chunks
+    np.testing.assert_allclose(fdeb.compute_forces_sparse(edges, pairs, kp), expected, rtol=tolerance,
+                               atol=tolerance)
+
+
+@pytest.mark.parametrize('block', [300, 64, 1])
+def test_range_forces_match_sparse_forces(block):
+    fdeb, edges, pairs, kp = bundling_state()
+    expected = fdeb.compute_forces_sparse(edges, pairs, kp).copy()
+
+    indptr, indices = fdeb.neighbor_lists(len(edges), pairs)
+    fdeb.pair_chunk_size = 50
+    forces = np.concatenate([fdeb.compute_forces_range(edges, indptr, indices, kp, lo, min(lo + block, len(edges)))
+                             .copy() for lo in range(0, len(edges), block)])
+    np.testing.assert_allclose(forces, expected, rtol=1e-10, atol=1e-10)
+
+
+# Budgets that split the work into several tiles, into tiles of a single item and below the size of one item
+@pytest.mark.parametrize('max_bytes', [200000, 2000, 1])
+def test_tiled_forces_match_untiled_forces(max_bytes):
+    fdeb, edges, pairs, kp = bundling_state()
+    compat = dense_compatibility(len(edges), pairs)
+    expected_dense = fdeb.compute_forces(edges, compat, kp).copy()
+    expected_sparse = fdeb.compute_forces_sparse(edges, pairs, kp).copy()
+
+    fdeb.max_bytes = max_bytes
+    fdeb.workspace = None
+    np.testing.assert_allclose(fdeb.compute_forces(edges, compat, kp), expected_dense, rtol=1e-10, atol=1e-10)
+    np.testing.assert_allclose(fdeb.compute_forces_sparse(edges, pairs, kp), expected_sparse, rtol=1e-10, atol=1e-10)
+
+
+def test_tile_size_holds_at_least_one_item():
+    fdeb = Fdeb()
+    fdeb.max_bytes = 1000
+    assert fdeb._tile_size(100, 64) == 10
+    assert fdeb._tile_size(5000, 64) == 1
+    fdeb.max_bytes = None
+    assert fdeb._tile_size(5000, 64) == 64
@@ -0,0 +1,32 @@
+import numpy as np
+import pytest
+
+from fdeb import Fdeb
+
+
+def bundled_run(edges: np.ndarray, sparse_compat: bool = True) -> tuple:
+    fdeb = Fdeb()
+    fdeb.n_cycles, fdeb.n_iter = 3, 10
+    fdeb.sparse_compat = sparse_compat
+    bundled = fdeb.my_fdeb(edges.copy())
+    return fdeb, bundled
+
+
+def test_pairs_match_a_fresh_computation(hub_routes):
+    edges, added = hub_routes[:280], hub_routes[280:]
+    removed = np.array([0, 17, 140, 279])
+    fdeb, bundled = bundled_run(edges)
+
+    straight, result, pairs = fdeb.my_fdeb_incremental(edges, bundled, fdeb.edge_compatibilities, added, removed)
+
+    expected_straight = np.concatenate([np.delete(edges, removed, axis=0), added])
+    np.testing.assert_array_equal(straight, expected_straight)
+    np.testing.assert_array_equal(pairs, Fdeb().get_sparse_edge_compatibility(expected_straight))
+    assert result.shape == (len(expected_straight), bundled.shape[1], 2)
+    np.testing.assert_allclose(result[:, [0, -1]], expected_straight, rtol=0, atol=1e-9)
+
+
+def test_dense_compatibility_is_rejected(hub_routes):
+    fdeb, bundled = bundled_run(hub_routes, sparse_compat=False)
+    with pytest.raises(ValueError):
+        fdeb.my_fdeb_incremental(hub_routes, bundled, fdeb.edge_compatibilities, removed=[0])
@@ -0,0 +1,72 @@
+import os
+
+import numpy as np
+import pytest
+
+from fdeb import Fdeb
+from fdeb_outofcore import OutOfCoreFdeb
+
+
+class Interrupt(Exception):
+    pass
+
+
+def configure(fdeb: Fdeb) -> Fdeb:
+    fdeb.n_cycles, fdeb.n_iter = 4, 20
+    return fdeb
+
+
+def out_of_core(directory) -> OutOfCoreFdeb:
+    fdeb = configure(OutOfCoreFdeb(str(directory)))
+    fdeb.block_size = 64  # several blocks
+    fdeb.compat_block_size = 50
+    return fdeb
+
+
+# Callback that stops the run at the given event of the given cycle, at the given iteration for iteration events
+def interrupt_at(name: str, cycle: int, iteration: int = None):
+    def callback(event: dict):
+        if event['event'] == name and event['cycle'] == cycle and event.get('iteration') == iteration:
+            raise Interrupt()
+    return callback
+
+
+@pytest.mark.parametrize('spatial_pruning', [True, False])
+def test_pairs_match_in_memory(tmp_path, hub_routes, spatial_pruning):
+    fdeb = out_of_core(tmp_path)
+    fdeb.spatial_pruning = spatial_pruning
+    edges = hub_routes[:, [0, -1]]
+    n_pairs = fdeb.write_pairs(edges)
+
+    pairs = np.fromfile(tmp_path / 'pairs.int32', dtype=np.int32).reshape(-1, 2)
+    expected = Fdeb().get_sparse_edge_compatibility(edges)
+    assert n_pairs == len(expected)
+    assert set(map(tuple, pairs.tolist())) == set(map(tuple, expected.tolist()))
+
+
+def test_matches_in_memory(tmp_path, hub_routes):
+    expected = configure(Fdeb()).my_fdeb(hub_routes.copy())
+    bundled = out_of_core(tmp_path).my_fdeb(hub_routes.copy())
+    np.testing.assert_allclose(bundled, expected, rtol=0, atol=1e-6)
+
+
+@pytest.mark.parametrize('event, cycle, iteration', [('cycle', 1, None), ('iteration', 0, 5)])
+def test_resumes_after_interruption(tmp_path, hub_routes, event, cycle, iteration):
+    expected = configure(Fdeb()).my_fdeb(hub_routes.copy())
+
+    fdeb = out_of_core(tmp_path)
+    fdeb.callbacks.append(interrupt_at(event, cycle, iteration))
+    with pytest.raises(Interrupt):
+        fdeb.my_fdeb(hub_routes.copy())
+    pairs_written = os.stat(tmp_path / 'pairs.int32').st_mtime_ns
+
+    # The resumed run neither scores the pairs again nor repeats a completed cycle
+    fdeb = out_of_core(tmp_path)
+    events = []
+    fdeb.callbacks.append(events.append)
+    bundled = fdeb.my_fdeb(hub_routes.copy())
+
+    assert os.stat(tmp_path / 'pairs.int32').st_mtime_ns == pairs_written
+    first_cycle = min(e['cycle'] for e in events if e['event'] == 'cycle')
+    assert first_cycle == (cycle + 1 if event == 'cycle' else cycle)
+    np.testing.assert_allclose(bundled, expected, rtol=0, atol=1e-6)
@@ -0,0 +1,24 @@
+import numpy as np
+import pytest
+
+from polyline import significance, simplify
+
+
+# Polylines on a coarse integer grid, with collinear points, zero-length segments and ties between farthest points
+def grid_polylines(n_points: int, seed: int = 0) -> np.ndarray:
+    return np.random.default_rng(seed).integers(0, 5, (300, n_points, 2)).astype(np.float64)
+
+
+@pytest.mark.parametrize('n_points', [2, 3, 9, 20])
+def test_significance_yields_every_simplification(n_points):
+    edges = grid_polylines(n_points)
+    point_significance = significance(edges)
+    for tolerance in (0, 0.3, 0.5, 1, 1.5, 2, 3, 5):
+        np.testing.assert_array_equal(simplify(edges, tolerance), point_significance > tolerance)
+
+
+def test_simplify_keeps_endpoints_and_straight_lines():
+    edges = np.stack([np.linspace([0, 0], [10, 5], 7), np.linspace([3, 3], [3, 3], 7)])
+    keep = simplify(edges, 1e-9)
+    np.testing.assert_array_equal(keep, [[True] + [False] * 5 + [True]] * 2)
+    assert simplify(edges, -1).all()
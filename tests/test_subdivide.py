@@ -0,0 +1,86 @@
+import math
+
+import numpy as np
+import pytest
+
+from fdeb import Fdeb
+
+
+# The per-segment Python loop subdivide_edges replaced, kept as the reference it must agree with
+def subdivide_edges_loop(edges: np.ndarray, num_points: int) -> np.ndarray:
+    segment_vecs = [[edges[i][j + 1] - edges[i][j] for j in range(len(edges[i]) - 1)] for i in range(len(edges))]
+    segment_lens = [[math.sqrt(sum((x_k ** 2 for x_k in segment_vecs[i][j]))) for j in range(len(segment_vecs[i]))]
+                    for i in range(len(segment_vecs))]
+    cum_segment_lens = np.array([[0] + [sum(segment_lens[i][:j + 1]) for j in range(len(segment_lens[i]))] for i in
+                                 range(len(segment_lens))])
+
+    total_lens = cum_segment_lens[:, -1]
+    t = np.linspace(0, 1, num=num_points, endpoint=True)
+    desired_lens = t * total_lens[:, None]
+    i = np.argmax(desired_lens[:, None] < cum_segment_lens[..., None], axis=1)
+    pct = (desired_lens - np.take_along_axis(np.array(cum_segment_lens), i - 1, axis=-1)) / (
+            np.take_along_axis(np.array(segment_lens), i - 1, axis=-1) + 1e-8
+    )
+
+    row_indices = np.arange(edges.shape[0])[:, None]
+    new_points = (
+            (1 - pct[..., None]) * edges[row_indices, i - 1]
+            + pct[..., None] * edges[row_indices, i]
+    )
+
+    return new_points
+
+
+# The spring half of the original per-point compute_forces, kept as the reference compute_spring_forces must agree with
+def spring_forces_loop(e: np.ndarray, kp: np.ndarray) -> np.ndarray:
+    v_spring_l = np.array([[e[i][j] - e[i][j + 1] for j in range(len(e[i]) - 1)] for i in range(len(e))])
+    v_spring_r = np.array([[e[i][j + 1] - e[i][j] for j in range(len(e[i]) - 1)] for i in range(len(e))])
+    v_spring_l_new = np.zeros((v_spring_l.shape[0], v_spring_l.shape[1]+1, v_spring_l.shape[-1]))
+    v_spring_r_new = np.zeros((v_spring_r.shape[0], v_spring_r.shape[1]+1, v_spring_r.shape[-1]))
+
+    for i in range(v_spring_l.shape[0]):
+        sub_arr_l = np.zeros((v_spring_l.shape[1]+1, v_spring_l.shape[-1]))
+        sub_arr_l[1:, :] = v_spring_l[i, :, :]
+        v_spring_l_new[i, :, :] = sub_arr_l
+
+        sub_arr_r = np.zeros((v_spring_r.shape[1]+1, v_spring_r.shape[-1]))
+        sub_arr_r[:-1, :] = v_spring_r[i, :, :]
+        v_spring_r_new[i, :, :] = sub_arr_r
+
+    f_spring_l = np.sum(v_spring_l_new ** 2, axis=-1, keepdims=True)
+    f_spring_r = np.sum(v_spring_r_new ** 2, axis=-1, keepdims=True)
+    return kp * (f_spring_l * v_spring_l_new + f_spring_r * v_spring_r_new)
+
+
+# Polylines on a coarse integer grid, so that many of their segments have zero length, plus edges collapsed to a
+# single point
+def random_polylines(n_edges: int, n_points: int, dtype: str, seed: int = 0) -> np.ndarray:
+    rng = np.random.default_rng(seed)
+    edges = rng.integers(0, 4, (n_edges, n_points, 2)).astype(dtype) * 25
+    edges[:5] = edges[:5, :1]
+    return edges
+
+
+@pytest.mark.parametrize('dtype, tolerance', [('float64', 1e-9), ('float32', 1e-3)])
+@pytest.mark.parametrize('n_points', [2, 3, 7])
+@pytest.mark.parametrize('num_points', [2, 5, 34])
+def test_subdivision_matches_loop(dtype, tolerance, n_points, num_points):
+    edges = random_polylines(200, n_points, dtype)
+    subdivided = Fdeb().subdivide_edges(edges, num_points)
+
+    assert subdivided.shape == (len(edges), num_points, 2)
+    assert np.isfinite(subdivided).all()
+    np.testing.assert_allclose(subdivided, subdivide_edges_loop(edges, num_points), rtol=0, atol=tolerance)
+    np.testing.assert_allclose(subdivided[:, [0, -1]], edges[:, [0, -1]], rtol=0, atol=tolerance)
+
+
+@pytest.mark.parametrize('dtype, tolerance', [('float64', 1e-12), ('float32', 1e-5)])
+@pytest.mark.parametrize('n_points', [2, 3, 7])
+def test_spring_forces_match_loop(dtype, tolerance, n_points):
+    # Scaled down like in my_fdeb, so that the cubic spring term stays of order one
+    edges = random_polylines(200, n_points, dtype) / 100
+    kp = np.random.default_rng(1).uniform(0.1, 1, (200, 1, 1)).astype(dtype)
+    forces = Fdeb().compute_spring_forces(edges, kp)
+
+    assert forces.dtype == edges.dtype
+    np.testing.assert_allclose(forces, spring_forces_loop(edges, kp), rtol=tolerance, atol=tolerance)